@@ -1,10 +1,11 @@
 import os
 import sqlite3
-import shutil
 from datetime import datetime
 from pathlib import Path
 import logging
+import queue
 import threading
+import time
 from flask import g, current_app
 import click
 from flask.cli import with_appcontext
@@ -16,6 +17,24 @@ logger = logging.getLogger(__name__)
 _db_path = None
 _db_path_lock = threading.Lock()  # Thread safety for _db_path initialization
 
+# Idle request connections kept per (process, database path), so requests reuse
+# an already configured connection and its page cache instead of reconnecting.
+# Keyed by pid because gunicorn preloads the app: connections opened in the
+# master during init_db must never be handed to a forked worker.
+_DB_POOL_SIZE = 4
+_db_pools = {}
+_db_pools_lock = threading.Lock()
+# Prepared statements kept per pooled connection. The default of 128 is shared
+# by the fixed queries and the variants built per IN (...) chunk size and
+# company-update field set; a larger cache keeps the fixed ones from being
+# evicted and re-parsed
+_STATEMENT_CACHE_SIZE = 256
+
+# Backup debounce state (per process) and online backup step size
+_last_backup_ts = float('-inf')
+_backup_lock = threading.Lock()
+_BACKUP_PAGES_PER_STEP = 100
+
 
 def _configure_connection(db, include_wal_optimizations=True):
     """
@@ -24,6 +43,10 @@ def _configure_connection(db, include_wal_optimizations=True):
     Uses executescript() to batch all PRAGMA statements into a single call,
     reducing the overhead of multiple execute() calls by ~20-30%.
 
+    WAL with synchronous=NORMAL only fsyncs at checkpoints, not on every
+    commit. A power loss can drop the most recently committed transactions,
+    but the database always stays consistent.
+
     Args:
         db: SQLite database connection
         include_wal_optimizations: If True, include additional WAL mode optimizations
@@ -37,6 +60,7 @@ def _configure_connection(db, include_wal_optimizations=True):
             PRAGMA synchronous = NORMAL;
             PRAGMA temp_store = MEMORY;
             PRAGMA cache_size = -64000;
+            PRAGMA mmap_size = 268435456;
         ''')
     else:
         # Minimal set for new database creation (before WAL is stable)
@@ -51,13 +75,29 @@ def set_db_path(path):
     global _db_path
     _db_path = path
 
+def _get_db_pool(db_path):
+    """Return this process's idle connection pool for db_path."""
+    key = (os.getpid(), db_path)
+    with _db_pools_lock:
+        pool = _db_pools.get(key)
+        if pool is None:
+            pool = _db_pools[key] = queue.LifoQueue(maxsize=_DB_POOL_SIZE)
+    return pool
+
 def get_db():
     """
     Get a database connection for the current request.
-    The connection is cached and reused for the same request.
+    The connection is cached and reused for the same request, and taken from
+    (and returned to by close_db) a small per-process pool of idle connections.
     """
     if 'db' not in g:
         db_path = current_app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', '')
+        try:
+            g.db = _get_db_pool(db_path).get_nowait()
+            g.db_path = db_path
+            return g.db
+        except queue.Empty:
+            pass
         
         # Ensure the database directory exists
         db_dir = os.path.dirname(db_path)
@@ -71,7 +111,9 @@ def get_db():
         
         # Try to connect to the database
         try:
-            g.db = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES)
+            g.db = sqlite3.connect(
+                db_path, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False,
+                cached_statements=_STATEMENT_CACHE_SIZE)
             g.db.row_factory = sqlite3.Row
             _configure_connection(g.db)
             logger.debug(f"Connected to database: {db_path}")
@@ -81,13 +123,16 @@ def get_db():
             try:
                 # Touch the file to create it
                 Path(db_path).touch(exist_ok=True)
-                g.db = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES)
+                g.db = sqlite3.connect(
+                    db_path, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False,
+                    cached_statements=_STATEMENT_CACHE_SIZE)
                 g.db.row_factory = sqlite3.Row
                 _configure_connection(g.db, include_wal_optimizations=False)
                 logger.info(f"Created and connected to new database: {db_path}")
             except Exception as create_error:
                 logger.error(f"Failed to create database file {db_path}: {create_error}")
                 raise
+        g.db_path = db_path
     return g.db
 
 def get_background_db():
@@ -147,9 +192,21 @@ def get_background_db():
             raise
 
 def close_db(e=None):
-    """Close the database connection at the end of the request."""
+    """
+    Release the request's database connection at the end of the request.
+
+    Any transaction left open is rolled back before the connection goes back
+    to the pool; it is closed instead when the pool is full or it is unusable.
+    """
     db = g.pop('db', None)
-    if db is not None:
+    db_path = g.pop('db_path', None)
+    if db is None:
+        return
+    try:
+        if db.in_transaction:
+            db.rollback()
+        _get_db_pool(db_path).put_nowait(db)
+    except (queue.Full, sqlite3.Error):
         db.close()
 
 def init_db(app):
@@ -327,10 +384,29 @@ def create_default_data(db):
     db.commit()
     logger.info("Default global account created.")
 
-def backup_database():
+def backup_database(force=False):
     """
     Create a backup of the current database.
+
+    Write handlers call this before every change, so backups are debounced:
+    unless force is set, a call within BACKUP_MIN_INTERVAL_SECONDS of the
+    last backup taken by this process (or while another thread is backing
+    up) is skipped and returns None.
+
+    Uses SQLite's online backup API, which copies a consistent snapshot
+    including pages still in the WAL file, a step at a time.
     """
+    global _last_backup_ts
+
+    min_interval = current_app.config.get('BACKUP_MIN_INTERVAL_SECONDS', 300)
+    if not force and time.monotonic() - _last_backup_ts < min_interval:
+        logger.debug("Skipping database backup, last backup is recent")
+        return None
+
+    if not _backup_lock.acquire(blocking=force):
+        logger.debug("Skipping database backup, another backup is in progress")
+        return None
+
     try:
         db_path = current_app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', '')
         # Use backups folder in instance
@@ -342,7 +418,17 @@ def backup_database():
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         backup_filename = os.path.join(backup_dir, f"backup_{timestamp}.db")
 
-        shutil.copy(db_path, backup_filename)
+        src = sqlite3.connect(db_path)
+        try:
+            dst = sqlite3.connect(backup_filename)
+            try:
+                src.backup(dst, pages=_BACKUP_PAGES_PER_STEP)
+            finally:
+                dst.close()
+        finally:
+            src.close()
+
+        _last_backup_ts = time.monotonic()
         logger.info(f"Database backed up successfully to {backup_filename}")
 
         # Clean up old backups
@@ -351,6 +437,31 @@ def backup_database():
     except Exception as e:
         logger.error(f"Database backup failed: {e}")
         return None
+    finally:
+        _backup_lock.release()
+
+def backup_database_in_background():
+    """
+    Run a debounced backup_database() on a daemon thread.
+
+    For request handlers that want a periodic snapshot without paying for
+    the copy in their own latency. Returns the started thread, or None when
+    the last backup is still recent.
+    """
+    min_interval = current_app.config.get('BACKUP_MIN_INTERVAL_SECONDS', 300)
+    if time.monotonic() - _last_backup_ts < min_interval or _backup_lock.locked():
+        return None
+
+    # Capture app reference while context is active (for use in background thread)
+    app = current_app._get_current_object()
+
+    def backup_worker():
+        with app.app_context():
+            backup_database()
+
+    backup_thread = threading.Thread(target=backup_worker, daemon=True)
+    backup_thread.start()
+    return backup_thread
 
 def cleanup_old_backups(directory, max_files=10):
     """
@@ -394,6 +505,30 @@ def query_db(query, args=(), one=False):
         logger.error(f"Args were: {args}")
         raise
 
+def query_db_raw(query, args=()):
+    """
+    Query the database and return results as plain tuples.
+
+    For bulk reads whose rows are unpacked positionally; skips building an
+    sqlite3.Row and a dict for every row.
+    """
+    try:
+        logger.debug(f"Executing query: {query}")
+        logger.debug(f"Query args: {args}")
+
+        cursor = get_db().cursor()
+        cursor.row_factory = None
+        rv = cursor.execute(query, args).fetchall()
+        cursor.close()
+
+        logger.debug(f"Query returned {len(rv)} rows")
+        return rv
+    except Exception as e:
+        logger.error(f"Database query failed: {str(e)}")
+        logger.error(f"Query was: {query}")
+        logger.error(f"Args were: {args}")
+        raise
+
 def execute_db(query, args=()):
     """
     Execute a statement and commit changes, returning the rowcount.
@@ -444,7 +579,7 @@ def migrate_database():
     cursor = db.cursor()
 
     # Latest migration version
-    LATEST_VERSION = 19
+    LATEST_VERSION = 23
 
     try:
         # Get current schema version
@@ -825,6 +960,72 @@ def migrate_database():
             db.commit()
             logger.info("Migration 19 completed: added type, cloned_from_portfolio_id, cloned_from_name to simulations")
 
+        # Migration 20: Drop indexes duplicating primary keys, refresh planner statistics
+        # idx_market_prices_identifier and idx_company_shares_company_id only cost
+        # writes; ANALYZE fills sqlite_stat1 so the planner picks the right indexes
+        if current_version < 20:
+            logger.info("Applying migration 20: Dropping redundant indexes and analyzing tables")
+            cursor.execute('DROP INDEX IF EXISTS idx_market_prices_identifier')
+            cursor.execute('DROP INDEX IF EXISTS idx_company_shares_company_id')
+            cursor.execute('ANALYZE')
+            cursor.execute("UPDATE schema_version SET version = 20, applied_at = CURRENT_TIMESTAMP")
+            db.commit()
+            logger.info("Migration 20 completed: redundant indexes dropped, statistics refreshed")
+
+        # Migration 21: idx_state_lookup duplicates the UNIQUE (account_id, page_name, variable_name)
+        # autoindex, which the state lookups already use
+        if current_version < 21:
+            logger.info("Applying migration 21: Dropping duplicate expanded_state lookup index")
+            cursor.execute('DROP INDEX IF EXISTS idx_state_lookup')
+            cursor.execute("UPDATE schema_version SET version = 21, applied_at = CURRENT_TIMESTAMP")
+            db.commit()
+            logger.info("Migration 21 completed: duplicate expanded_state index dropped")
+
+        # Migration 22: Covering index for per-account company scans
+        # Holds every companies column the metrics summary reads, so that query is
+        # answered from the index; it also serves the account_id-only lookups
+        # idx_companies_account_id was kept for
+        if current_version < 22:
+            logger.info("Applying migration 22: Replacing companies account index with a covering index")
+            cursor.execute(
+                'CREATE INDEX IF NOT EXISTS idx_companies_account_covering '
+                'ON companies(account_id, identifier, is_custom_value, custom_total_value)'
+            )
+            cursor.execute('DROP INDEX IF EXISTS idx_companies_account_id')
+            cursor.execute("UPDATE schema_version SET version = 22, applied_at = CURRENT_TIMESTAMP")
+            db.commit()
+            logger.info("Migration 22 completed: covering companies account index created")
+
+        # Migration 23: Store market_prices as a WITHOUT ROWID table
+        # Prices are only ever looked up by identifier; clustering the rows on
+        # that key turns every join probe into a single B-tree search instead
+        # of an autoindex search plus a rowid fetch
+        if current_version < 23:
+            logger.info("Applying migration 23: Rebuilding market_prices as a WITHOUT ROWID table")
+            cursor.execute('''
+                CREATE TABLE market_prices_new (
+                    identifier TEXT PRIMARY KEY,
+                    price REAL,
+                    currency TEXT,
+                    price_eur REAL,
+                    last_updated DATETIME,
+                    country TEXT
+                ) WITHOUT ROWID
+            ''')
+            # WITHOUT ROWID primary keys are NOT NULL; a NULL identifier row could never be joined
+            cursor.execute('''
+                INSERT INTO market_prices_new (identifier, price, currency, price_eur, last_updated, country)
+                SELECT identifier, price, currency, price_eur, last_updated, country
+                FROM market_prices
+                WHERE identifier IS NOT NULL
+            ''')
+            cursor.execute('DROP TABLE market_prices')
+            cursor.execute('ALTER TABLE market_prices_new RENAME TO market_prices')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_market_prices_last_updated ON market_prices(last_updated)')
+            cursor.execute("UPDATE schema_version SET version = 23, applied_at = CURRENT_TIMESTAMP")
+            db.commit()
+            logger.info("Migration 23 completed: market_prices is now a WITHOUT ROWID table")
+
         logger.info(f"Database migrations completed successfully (version {LATEST_VERSION})")
 
     except sqlite3.Error as e:
@@ -0,0 +1,55 @@
+"""
+JSON provider module.
+
+Serializes jsonify() responses with orjson when it is installed, falling back
+to Flask's default (stdlib json) provider otherwise.
+Philosophy: Same output as the default provider, just faster.
+"""
+
+from typing import Any
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+# Datetimes are passed through to DefaultJSONProvider.default() so they keep
+# Flask's HTTP date format instead of orjson's ISO 8601 output
+_ORJSON_OPTIONS = (
+    orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATETIME
+    if orjson else 0
+)
+_COMPACT_SEPARATORS = (',', ':')
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """DefaultJSONProvider that encodes and decodes with orjson"""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        # response() asks for compact separators, which is orjson's only layout;
+        # any other stdlib options (e.g. indent for debug responses) keep the
+        # stdlib encoder
+        if kwargs and kwargs != {'separators': _COMPACT_SEPARATORS}:
+            return super().dumps(obj, **kwargs)
+
+        options = _ORJSON_OPTIONS | (orjson.OPT_SORT_KEYS if self.sort_keys else 0)
+        try:
+            return orjson.dumps(obj, default=self.default, option=options).decode()
+        except orjson.JSONEncodeError:
+            # e.g. integers beyond 64 bits, which the stdlib encoder handles
+            return super().dumps(obj, **kwargs)
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+
+def init_json_provider(app) -> None:
+    """Use orjson for the app's JSON handling when it is installed"""
+    if orjson is None:
+        app.logger.debug("orjson not installed, using default JSON provider")
+        return
+    app.json = OrjsonProvider(app)
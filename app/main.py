@@ -3,6 +3,7 @@ import logging
 import os
 from datetime import datetime
 from app.cache import cache
+from app.json_provider import init_json_provider
 
 def create_app(config_name=None):
     import time
@@ -41,6 +42,9 @@ def create_app(config_name=None):
     # Initialize cache with app
     cache.init_app(app)
 
+    # Serialize JSON responses with orjson when available
+    init_json_provider(app)
+
     # Override with additional settings for development
     if config_name == 'development':
         app.config.update(
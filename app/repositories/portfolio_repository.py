@@ -287,6 +287,54 @@ class PortfolioRepository:
 
         return query_db(query, [account_id])
 
+    @staticmethod
+    def get_portfolio_metrics_summary(account_id: int) -> List[Dict]:
+        """
+        Get holding counts, value sums and latest price update per currency.
+
+        Applies the same valuation priority as value_calculator.calculate_item_value()
+        and the same zero-share filter as get_portfolio_data_with_enrichment(),
+        but aggregates in SQL so no per-item rows are loaded. Native prices are
+        summed per currency and left for the caller to convert to EUR.
+
+        Args:
+            account_id: Account ID
+
+        Returns:
+            List of dicts with currency, total_items, priced_items, custom_total,
+            native_total, eur_total and last_update
+        """
+        query = '''
+            WITH holdings AS (
+                SELECT
+                    mp.currency,
+                    mp.price,
+                    mp.price_eur,
+                    mp.last_updated,
+                    c.custom_total_value,
+                    COALESCE(cs.override_share, cs.shares, 0) AS shares,
+                    (c.is_custom_value = 1 AND c.custom_total_value IS NOT NULL) AS has_custom,
+                    (mp.price > 0 AND mp.currency IS NOT NULL AND mp.currency != '') AS has_native
+                FROM companies c
+                LEFT JOIN company_shares cs ON c.id = cs.company_id
+                LEFT JOIN market_prices mp ON c.identifier = mp.identifier
+                WHERE c.account_id = ?
+                AND COALESCE(cs.override_share, cs.shares, 0) > 1e-6
+            )
+            SELECT
+                currency,
+                COUNT(*) AS total_items,
+                SUM(CASE WHEN has_custom OR has_native OR price_eur > 0 THEN 1 ELSE 0 END) AS priced_items,
+                SUM(CASE WHEN has_custom THEN custom_total_value ELSE 0 END) AS custom_total,
+                SUM(CASE WHEN has_custom THEN 0 WHEN has_native THEN price * shares ELSE 0 END) AS native_total,
+                SUM(CASE WHEN has_custom OR has_native THEN 0 ELSE COALESCE(price_eur, 0) * shares END) AS eur_total,
+                MAX(last_updated) AS last_update
+            FROM holdings
+            GROUP BY currency
+        '''
+
+        return query_db(query, [account_id])
+
     @staticmethod
     def get_holdings_without_prices(account_id: int) -> List[Dict]:
         """
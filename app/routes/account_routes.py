@@ -4,6 +4,7 @@ from flask import (
 )
 from app.db_manager import query_db, execute_db, backup_database, get_db
 from app.decorators import require_auth
+from app.routes.portfolio_api import invalidate_portfolio_cache
 from app.exceptions import ValidationError, DataIntegrityError
 
 import sqlite3
@@ -135,7 +136,7 @@ def reset_account_settings():
 
     try:
         # Create backup before making changes
-        backup_database()
+        backup_database(force=True)
 
         # Remove all expanded_state entries for this account
         execute_db('DELETE FROM expanded_state WHERE account_id = ?', [account_id])
@@ -164,7 +165,7 @@ def delete_account():
 
     try:
         # Create backup before making changes
-        backup_database()
+        backup_database(force=True)
 
         # Use context manager so commit/rollback happen automatically
         with get_db() as db:
@@ -259,6 +260,8 @@ def delete_account():
 
             db.execute('DELETE FROM accounts WHERE id = ?', [account_id])
 
+        invalidate_portfolio_cache(account_id)
+
         session.pop('account_id', None)
         session.pop('username', None)
 
@@ -281,7 +284,7 @@ def delete_stocks_crypto():
 
     try:
         # Create backup before making changes
-        backup_database()
+        backup_database(force=True)
 
         # Use context manager so commit/rollback happen automatically
         with get_db() as db:
@@ -327,6 +330,8 @@ def delete_stocks_crypto():
             else:
                 logger.info("No identifiers found for cleanup after stock/crypto deletion")
 
+        invalidate_portfolio_cache(account_id)
+
         flash('All stocks and crypto data deleted successfully', 'success')
 
     except (DataIntegrityError, ValidationError) as e:
@@ -434,7 +439,7 @@ def import_data():
             return redirect(url_for('account.index'))
 
         # Create backup before making changes
-        backup_database()
+        backup_database(force=True)
 
         # Use transaction for data import
         with get_db() as db:
@@ -680,6 +685,8 @@ def import_data():
             
             logger.info(f"Import verification: {expanded_imported} expanded_state, {mappings_imported} identifier_mappings imported for account {account_id}")
 
+        invalidate_portfolio_cache(account_id)
+
         flash('Account data imported successfully! Portfolio allocations have been preserved.', 'success')
 
     except json.JSONDecodeError:
@@ -1,62 +1,216 @@
 from flask import (
-    request, flash, session, jsonify, redirect, url_for, Response, g
+    request, flash, session, jsonify, redirect, url_for, Response, g,
+    stream_with_context, current_app
+)
+from app.db_manager import (
+    query_db, query_db_raw, execute_db, backup_database, backup_database_in_background, get_db
 )
-from app.db_manager import query_db, execute_db, backup_database, get_db
 from app.decorators import require_auth
 from app.utils.db_utils import (
-    load_portfolio_data, process_portfolio_dataframe, update_price_in_db, update_batch_prices_in_db
+    load_portfolio_data, process_portfolio_dataframe, update_batch_prices_in_db
+)
+from app.utils.yfinance_utils import get_yfinance_info, get_historical_prices, VALID_PERIODS
+from app.utils.batch_processing import (
+    start_batch_process, get_csv_job_progress, start_csv_processing_job, cancel_background_job,
+    save_csv_upload, discard_csv_upload
 )
-from app.utils.yfinance_utils import get_isin_data, get_yfinance_info
-from app.utils.batch_processing import start_batch_process, get_job_status, start_csv_processing_job, cancel_background_job
 from app.utils.portfolio_utils import (
-    get_portfolio_data, process_csv_data, has_companies_in_default, get_stock_info
+    get_portfolio_data, process_csv_data, get_stock_info
 )
 from app.utils.response_helpers import success_response, error_response, not_found_response, validation_error_response, service_unavailable_response
 from app.exceptions import (
     ValidationError, DataIntegrityError, ExternalAPIError, NotFoundError,
     CSVProcessingError, PriceFetchError
 )
-from app.utils.value_calculator import calculate_portfolio_total, calculate_item_value, has_price_or_custom_value
+from app.utils.value_calculator import calculate_item_value, calculate_total_from_currency_totals
 from app.utils.portfolio_totals import get_portfolio_totals
-from app.utils.identifier_mapping import store_identifier_mapping
+from app.utils.identifier_mapping import store_identifier_mapping, get_preferred_identifier
 from app.utils.identifier_normalization import normalize_identifier
 from app.utils.text_normalization import normalize_sector, normalize_country, normalize_thesis
 from app.services.allocation_service import AllocationService
+from app.repositories.portfolio_repository import PortfolioRepository
 from app.cache import cache
 
 
 import logging
+import re
+import sqlite3
 from datetime import datetime
 import time
 import uuid
+import zlib
 import json
 import io
-from typing import Dict, Any, Optional, List
+from functools import lru_cache
+from itertools import groupby
+from typing import Callable, Dict, Any, Optional, List, Union
 
 # Set up logger
 logger = logging.getLogger(__name__)
 
+# historical_prices start_date format (YYYY-MM-DD)
+_START_DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+# Names per IN (...) lookup; stays below SQLite's historical 999-variable limit
+_IN_CLAUSE_CHUNK_SIZE = 900
+
+# Statements run on every portfolio edit or state load/save
+_PORTFOLIO_UPSERT_SQL = """INSERT INTO portfolios (name, account_id) VALUES (?, ?)
+    ON CONFLICT(account_id, name) DO UPDATE SET name = excluded.name
+    RETURNING id"""
+_STATE_SELECT_SQL = """SELECT variable_name, variable_type, variable_value
+    FROM expanded_state
+    WHERE account_id = ? AND page_name = ?"""
+_STATE_DELETE_SQL = "DELETE FROM expanded_state WHERE account_id = ? AND page_name = ?"
+_STATE_INSERT_SQL = """INSERT INTO expanded_state
+    (account_id, page_name, variable_name, variable_type, variable_value)
+    VALUES (?, ?, ?, ?, ?)"""
+# Batch editor company UPDATEs, one per investment_type variant
+_BATCH_COMPANY_UPDATE_SQL = (
+    "UPDATE companies SET identifier = ?, sector = ?, portfolio_id = ? WHERE id = ?"
+)
+_BATCH_COMPANY_UPDATE_WITH_TYPE_SQL = (
+    "UPDATE companies SET identifier = ?, sector = ?, portfolio_id = ?, investment_type = ? WHERE id = ?"
+)
+_BATCH_COMPANY_UPDATE_CLEAR_TYPE_SQL = (
+    "UPDATE companies SET identifier = ?, sector = ?, portfolio_id = ?, investment_type = NULL WHERE id = ?"
+)
+# company_id is the company_shares primary key, so one UPSERT covers new and existing rows
+_SHARES_USER_EDIT_UPSERT_SQL = """INSERT INTO company_shares
+    (company_id, shares, override_share, manual_edit_date, is_manually_edited, csv_modified_after_edit)
+    VALUES (?, ?, ?, CURRENT_TIMESTAMP, 1, 0)
+    ON CONFLICT(company_id) DO UPDATE SET
+        override_share = excluded.override_share,
+        manual_edit_date = CURRENT_TIMESTAMP,
+        is_manually_edited = 1,
+        csv_modified_after_edit = 0"""
+_SHARES_UPSERT_SQL = """INSERT INTO company_shares (company_id, shares, override_share)
+    VALUES (?, ?, ?)
+    ON CONFLICT(company_id) DO UPDATE SET
+        shares = excluded.shares,
+        override_share = excluded.override_share"""
+# Every named portfolio of an account, flagged when any company is assigned to it
+_ACCOUNT_PORTFOLIOS_SQL = """SELECT p.id, p.name,
+        EXISTS (SELECT 1 FROM companies c WHERE c.portfolio_id = p.id) AS has_companies
+    FROM portfolios p
+    WHERE p.account_id = ? AND p.name IS NOT NULL
+    ORDER BY p.name"""
+# Builder page targets and rules consumed by the rebalancing calculation
+_BUILDER_STATE_SQL = """SELECT variable_name, variable_value
+    FROM expanded_state
+    WHERE account_id = ? AND page_name = 'builder' AND variable_name IN ('portfolios', 'rules')"""
+# Portfolio ids in the order saved by the Builder page (JSON array of objects)
+_SAVED_PORTFOLIO_ORDER_SQL = """SELECT json_extract(j.value, '$.id') AS id
+    FROM expanded_state es, json_each(es.variable_value) j
+    WHERE es.account_id = ? AND es.page_name = 'builder' AND es.variable_name = 'portfolios'
+    AND json_extract(j.value, '$.id') IS NOT NULL
+    ORDER BY j.key"""
+
+
+def _get_portfolio_map(account_id: int) -> Dict[str, int]:
+    """
+    Get the portfolio name -> id map for an account, loaded once per request.
+
+    The map lives on flask.g rather than in a process-wide cache because the
+    app runs under several gunicorn workers, which would never see each other's
+    portfolio writes. Callers that insert a portfolio add it to the returned dict.
+    """
+    portfolio_maps = g.setdefault('portfolio_maps', {})
+    if account_id not in portfolio_maps:
+        rows = query_db(
+            'SELECT id, name FROM portfolios WHERE account_id = ?',
+            [account_id]
+        )
+        portfolio_maps[account_id] = {row['name']: row['id'] for row in rows or []}
+    return portfolio_maps[account_id]
+
 
-def _apply_company_update(cursor, company_id, data, account_id):
+def _get_or_create_portfolio_id(cursor, account_id: int, portfolio_name: str) -> int:
+    """
+    Resolve a portfolio id from the request's portfolio map, creating the
+    portfolio if it is missing.
+
+    The insert is a single UPSERT ... RETURNING on UNIQUE(account_id, name),
+    so a portfolio created meanwhile by another worker is reused instead of
+    raising an IntegrityError.
+    """
+    portfolio_map = _get_portfolio_map(account_id)
+    portfolio_id = portfolio_map.get(portfolio_name)
+    if portfolio_id is None:
+        portfolio_id = cursor.execute(
+            _PORTFOLIO_UPSERT_SQL, [portfolio_name, account_id]
+        ).fetchone()[0]
+        portfolio_map[portfolio_name] = portfolio_id
+        logger.info(
+            "Ensured '%s' portfolio for account_id: %s", portfolio_name, account_id)
+    return portfolio_id
+
+
+def _executemany_in_order(cursor, writes) -> None:
+    """
+    Run (sql, params) writes in request order.
+
+    Only consecutive writes sharing a statement are batched into one
+    executemany, so when a batch touches the same row more than once the
+    last write still wins.
+    """
+    for sql, run in groupby(writes, key=lambda write: write[0]):
+        cursor.executemany(sql, [params for _, params in run])
+
+
+# Whitelist of allowed fields that can be updated via _apply_company_update
+_COMPANY_UPDATE_ALLOWED_FIELDS = frozenset({
+    'identifier', 'name', 'sector', 'thesis', 'portfolio', 'investment_type',
+    'custom_total_value', 'custom_price_eur', 'is_custom_value_edit',
+    'country', 'reset_country', 'is_country_user_edit', 'reset_identifier',
+    'is_identifier_user_edit',
+    'shares', 'override_share', 'is_user_edit',
+    'reset_shares', 'reset_custom_value'
+})
+
+# Request keys that map directly onto a companies column
+_COMPANY_UPDATE_COLUMNS = {
+    'identifier': 'identifier = ?',
+    'name': 'name = ?',
+    'sector': 'sector = ?',
+    'thesis': 'thesis = ?',
+    'portfolio': 'portfolio_id = ?',
+}
+
+
+@lru_cache(maxsize=64)
+def _company_update_sql(set_clause_parts: tuple) -> str:
+    """
+    Build the companies UPDATE for one combination of SET fragments.
+
+    Edits from the UI only touch a handful of field combinations, so each
+    distinct statement is built once per process. The fragments come from
+    the whitelisted constants above, never from request data.
+    """
+    return f"UPDATE companies SET {', '.join(set_clause_parts)} WHERE id = ?"
+
+
+def _apply_company_update(cursor, company_id, data, account_id, current_company=None):
     """
     Internal helper to update company and share data.
 
     Security: Only whitelisted fields are processed to prevent SQL injection.
-    """
-    # Whitelist of allowed fields that can be updated via this function
-    ALLOWED_FIELDS = {
-        'identifier', 'name', 'sector', 'thesis', 'portfolio', 'investment_type',
-        'custom_total_value', 'custom_price_eur', 'is_custom_value_edit',
-        'country', 'reset_country', 'is_country_user_edit', 'reset_identifier',
-        'is_identifier_user_edit',
-        'shares', 'override_share', 'is_user_edit',
-        'reset_shares', 'reset_custom_value'
-    }
 
+    Callers updating many companies can pass the company's current
+    (identifier, name) row as current_company; otherwise it is read on the
+    cursor when the identifier is edited.
+
+    Returns:
+        The cleaned identifier whose price should be fetched once the caller
+        has committed (see start_batch_process), or None if the identifier
+        did not change. The yfinance call is left to the caller so the
+        transaction is not held open across a network round trip.
+    """
+    price_identifier = None
     # Validate that all keys in data are whitelisted
     for key in data.keys():
-        if key not in ALLOWED_FIELDS:
-            logger.warning(f"Ignoring non-whitelisted field '{key}' in company update")
+        if key not in _COMPANY_UPDATE_ALLOWED_FIELDS:
+            logger.warning("Ignoring non-whitelisted field '%s' in company update", key)
 
     # Normalize text fields before processing
     if 'sector' in data:
@@ -64,38 +218,16 @@ def _apply_company_update(cursor, company_id, data, account_id):
     if 'thesis' in data:
         data['thesis'] = normalize_thesis(data.get('thesis'))
 
-    portfolio_name = data.get('portfolio')
-    if portfolio_name and portfolio_name != 'None':
-        portfolio = query_db(
-            'SELECT id FROM portfolios WHERE name = ? AND account_id = ?',
-            [portfolio_name, account_id],
-            one=True
-        )
-        if not portfolio:
-            cursor.execute(
-                'INSERT INTO portfolios (name, account_id) VALUES (?, ?)',
-                [portfolio_name, account_id]
-            )
-            portfolio_id = cursor.lastrowid
-        else:
-            portfolio_id = portfolio['id'] if isinstance(portfolio, dict) else None
-    else:
-        # Assign to '-' portfolio if no portfolio is specified (consistent with CSV processing)
-        default_portfolio = query_db(
-            'SELECT id FROM portfolios WHERE name = ? AND account_id = ?',
-            ['-', account_id], one=True)
-
-        if not default_portfolio:
-            # Create '-' portfolio if it doesn't exist
-            cursor.execute(
-                'INSERT INTO portfolios (name, account_id) VALUES (?, ?)',
-                ['-', account_id]
-            )
-            portfolio_id = cursor.lastrowid
-            logger.info(
-                f"Created '-' portfolio for account_id: {account_id}")
-        else:
-            portfolio_id = default_portfolio['id'] if isinstance(default_portfolio, dict) else None
+    # Only resolve (and possibly create) a portfolio when the update assigns one;
+    # share, country and value edits never touch portfolio_id
+    portfolio_id = None
+    if 'portfolio' in data:
+        portfolio_name = data.get('portfolio')
+        if not portfolio_name or portfolio_name == 'None':
+            # Assign to '-' portfolio if no portfolio is specified (consistent with CSV processing)
+            portfolio_name = '-'
+
+        portfolio_id = _get_or_create_portfolio_id(cursor, account_id, portfolio_name)
 
     # Check if identifier is being changed to trigger price update and mapping storage
     identifier_changed = False
@@ -105,38 +237,24 @@ def _apply_company_update(cursor, company_id, data, account_id):
     if 'identifier' in data:
         new_identifier = data.get('identifier', '').strip()
         if new_identifier:  # Only if not empty
-            # Get current company data including name for mapping
-            current_company_data = query_db(
-                'SELECT identifier, name FROM companies WHERE id = ? AND account_id = ?',
-                [company_id, account_id], one=True
-            )
-            if current_company_data:
-                if isinstance(current_company_data, dict):
-                    current_identifier = current_company_data.get('identifier')
-                    current_company_name = current_company_data.get('name')
-                else:
-                    current_identifier = None
-                    current_company_name = None
-            else:
-                current_identifier = None
-                current_company_name = None
+            # Get current company data including name for mapping, on the caller's
+            # cursor so the lookup runs inside the update transaction
+            current_company_data = current_company
+            if current_company_data is None:
+                current_company_data = cursor.execute(
+                    'SELECT identifier, name FROM companies WHERE id = ? AND account_id = ?',
+                    [company_id, account_id]
+                ).fetchone()
+            current_identifier = current_company_data['identifier'] if current_company_data else None
             identifier_changed = (new_identifier != current_identifier)
 
     # Build the SET clause safely using whitelisted columns
     # This prevents SQL injection by explicitly mapping user input keys to known safe column names
-    ALLOWED_UPDATES = {
-        'identifier': 'identifier = ?',
-        'name': 'name = ?',
-        'sector': 'sector = ?',
-        'thesis': 'thesis = ?',
-        'portfolio': 'portfolio_id = ?',
-    }
-
     set_clause_parts = []
     params = []
 
     # Handle simple field updates using whitelist
-    for field_key, sql_fragment in ALLOWED_UPDATES.items():
+    for field_key, sql_fragment in _COMPANY_UPDATE_COLUMNS.items():
         if field_key in data:
             if field_key == 'portfolio':
                 # Special case: portfolio maps to portfolio_id
@@ -156,7 +274,7 @@ def _apply_company_update(cursor, company_id, data, account_id):
                     set_clause_parts.append('identifier_manually_edited = ?')
                     params.append(1)
                     set_clause_parts.append('identifier_manual_edit_date = CURRENT_TIMESTAMP')
-                    logger.info(f"Marking identifier as manually edited for company {company_id}")
+                    logger.info("Marking identifier as manually edited for company %s", company_id)
             else:
                 set_clause_parts.append(sql_fragment)
                 params.append(data.get(field_key, ''))
@@ -188,25 +306,23 @@ def _apply_company_update(cursor, company_id, data, account_id):
             params.append(1)
             # CURRENT_TIMESTAMP is a SQLite keyword, not a user value, so it's safe
             set_clause_parts.append('custom_value_date = CURRENT_TIMESTAMP')
-            logger.info(f"User set custom total value {custom_total_value} (price: {custom_price}) for company {company_id}")
+            logger.info("User set custom total value %s (price: %s) for company %s", custom_total_value, custom_price, company_id)
 
     # Execute UPDATE if there are changes
     if set_clause_parts:
-        # Build query with parameterized WHERE clause
-        set_clause = ', '.join(set_clause_parts)
-        query = f'UPDATE companies SET {set_clause} WHERE id = ?'
+        query = _company_update_sql(tuple(set_clause_parts))
         params.append(company_id)
 
         # Log for debugging (safe because set_clause is built from whitelisted parts)
-        logger.debug(f"Executing UPDATE: {query} with params: {params}")
+        logger.debug("Executing UPDATE: %s with params: %s", query, params)
         cursor.execute(query, params)
 
     # If identifier was changed, store mapping and fetch price
     if identifier_changed and new_identifier and current_company_data:
-        current_identifier = current_company_data.get('identifier') if isinstance(current_company_data, dict) else None
-        current_company_name = current_company_data.get('name') if isinstance(current_company_data, dict) else None
+        current_identifier = current_company_data['identifier']
+        current_company_name = current_company_data['name']
         
-        logger.info(f"Identifier changed for company {company_id} to '{new_identifier}', storing mapping and fetching price...")
+        logger.info("Identifier changed for company %s to '%s', storing mapping...", company_id, new_identifier)
         
         # NEW: Try to detect and store identifier mapping
         if current_identifier and current_company_name:
@@ -232,48 +348,13 @@ def _apply_company_update(cursor, company_id, data, account_id):
                 )
                 
                 if success:
-                    logger.info(f"Stored identifier mapping: {possible_csv_identifier} -> {new_identifier} for {current_company_name}")
+                    logger.info("Stored identifier mapping: %s -> %s for %s", possible_csv_identifier, new_identifier, current_company_name)
                 else:
-                    logger.warning(f"Failed to store identifier mapping for {current_company_name}")
+                    logger.warning("Failed to store identifier mapping for %s", current_company_name)
         
-        try:
-            # Clean up identifier (trim, uppercase) - no format conversion
-            cleaned_identifier = normalize_identifier(new_identifier)
-
-            logger.info(f"Cleaned identifier: '{new_identifier}' -> '{cleaned_identifier}'")
-            logger.info(f"Fetching price with two-step cascade...")
-
-            # Fetch price data from yfinance with cascade
-            # Cascade will try original, then crypto format if needed
-            price_data = get_isin_data(cleaned_identifier)
-            if price_data.get('success'):
-                # Extract nested data dictionary (matches pattern from batch_processing.py)
-                data = price_data.get('data', {})
-                price = data.get('currentPrice')
-                currency = data.get('currency', 'EUR')
-                price_eur = data.get('priceEUR')
-                country = data.get('country')
-                modified_identifier = price_data.get('modified_identifier')
-
-                # Ensure required parameters are not None
-                if price is not None and currency is not None and price_eur is not None:
-                    # update_price_in_db will update identifier if cascade found different format
-                    # e.g., BTC → BTC-USD
-                    update_price_in_db(
-                        identifier=cleaned_identifier,
-                        price=float(price),
-                        currency=str(currency),
-                        price_eur=float(price_eur),
-                        country=country,
-                        modified_identifier=modified_identifier
-                    )
-                    logger.info(f"Successfully updated price for '{cleaned_identifier}': {price_eur} EUR")
-                else:
-                    logger.warning(f"Missing required price data for '{cleaned_identifier}'")
-            else:
-                logger.warning(f"Failed to fetch price for '{cleaned_identifier}': {price_data.get('error', 'Unknown error')}")
-        except Exception as e:
-            logger.error(f"Error fetching price for '{cleaned_identifier}': {str(e)}")
+        # Clean up identifier (trim, uppercase) - no format conversion
+        price_identifier = normalize_identifier(new_identifier)
+        logger.info("Cleaned identifier: '%s' -> '%s'", new_identifier, price_identifier)
 
     # Handle identifier reset
     if data.get('reset_identifier', False):
@@ -285,7 +366,7 @@ def _apply_company_update(cursor, company_id, data, account_id):
                 identifier_manual_edit_date = NULL
             WHERE id = ?
         ''', [company_id])
-        logger.info(f"Reset identifier manual edit for company {company_id}")
+        logger.info("Reset identifier manual edit for company %s", company_id)
 
     # Handle country updates
     if 'country' in data or 'reset_country' in data:
@@ -298,7 +379,7 @@ def _apply_company_update(cursor, company_id, data, account_id):
                     country_manual_edit_date = NULL
                 WHERE id = ?
             ''', [company_id])
-            logger.info(f"Reset country override for company {company_id}")
+            logger.info("Reset country override for company %s", company_id)
         elif 'country' in data:
             country = normalize_country(data.get('country'))
             is_user_edit = data.get('is_country_user_edit', False)
@@ -311,16 +392,18 @@ def _apply_company_update(cursor, company_id, data, account_id):
                         country_manually_edited = 1
                     WHERE id = ?
                 ''', [country, company_id])
-                logger.info(f"User updated country to '{country}' for company {company_id}")
+                logger.info("User updated country to '%s' for company %s", country, company_id)
 
     if 'shares' in data or 'override_share' in data:
         shares = data.get('shares')
         override = data.get('override_share')
         is_user_edit = data.get('is_user_edit', False)  # Flag to indicate user vs system edit
         
-        exists = query_db(
+        # Read on the caller's cursor so the lookup sees this transaction's writes
+        exists = cursor.execute(
             'SELECT company_id, shares, override_share, is_manually_edited FROM company_shares WHERE company_id = ?',
-            [company_id], one=True)
+            [company_id]
+        ).fetchone()
         
         if exists:
             if is_user_edit and 'override_share' in data:
@@ -335,7 +418,7 @@ def _apply_company_update(cursor, company_id, data, account_id):
                 ''', [override, company_id])
             else:
                 # System update (e.g., CSV import) - update shares, preserve override_share if it exists
-                current_override = exists.get('override_share') if exists.get('is_manually_edited') else None
+                current_override = exists['override_share'] if exists['is_manually_edited'] else None
                 cursor.execute(
                     'UPDATE company_shares SET shares = ?, override_share = ? WHERE company_id = ?',
                     [shares, current_override or override, company_id]
@@ -365,7 +448,7 @@ def _apply_company_update(cursor, company_id, data, account_id):
                 csv_modified_after_edit = 0
             WHERE company_id = ?
         ''', [company_id])
-        logger.info(f"Reset shares override for company {company_id}")
+        logger.info("Reset shares override for company %s", company_id)
 
     # Handle custom value reset
     if data.get('reset_custom_value', False):
@@ -377,7 +460,9 @@ def _apply_company_update(cursor, company_id, data, account_id):
                 custom_value_date = NULL
             WHERE id = ?
         ''', [company_id])
-        logger.info(f"Reset custom value for company {company_id}")
+        logger.info("Reset custom value for company %s", company_id)
+
+    return price_identifier
 
 # API endpoint to get and save state data
 
@@ -395,32 +480,19 @@ def manage_state():
 
         try:
             # Get all state variables for this account and page
-            state_vars = query_db('''
-                SELECT variable_name, variable_type, variable_value
-                FROM expanded_state
-                WHERE account_id = ? AND page_name = ?
-            ''', [account_id, page_name])
+            state_vars = query_db(_STATE_SELECT_SQL, [account_id, page_name])
 
             if not state_vars:
                 return jsonify({})
 
-            # Convert to proper data structure
-            state_data = {}
-            for var in state_vars:
-                if isinstance(var, dict):
-                    var_name = var['variable_name']
-                    var_value = var['variable_value']
-
-                    # Add to state data without conversion (handled by front-end)
-                    state_data[var_name] = var_value
-
-            return jsonify(state_data)
+            # Values are returned as stored; conversion is handled by the front-end
+            return jsonify({var['variable_name']: var['variable_value'] for var in state_vars})
 
         except (DataIntegrityError, ValidationError) as e:
-            logger.error(f"Error retrieving state for page '{page_name}': {str(e)}")
+            logger.error("Error retrieving state for page '%s': %s", page_name, str(e))
             return error_response(str(e), 400 if isinstance(e, ValidationError) else 500)
         except Exception as e:
-            logger.exception(f"Unexpected error retrieving state for page '{page_name}'")
+            logger.exception("Unexpected error retrieving state for page '%s'", page_name)
             return error_response('Failed to retrieve state', 500)
 
     # POST request to save state
@@ -433,8 +505,8 @@ def manage_state():
         page_name = data['page']
 
         try:
-            # Create backup before making changes
-            backup_database()
+            # Periodic snapshot, taken off the request path
+            backup_database_in_background()
 
             with get_db() as db:
                 cursor = db.cursor()
@@ -443,31 +515,19 @@ def manage_state():
                 cursor.execute('BEGIN TRANSACTION')
 
                 # Delete existing state for this page (to avoid orphaned variables)
-                cursor.execute('''
-                DELETE FROM expanded_state
-                WHERE account_id = ? AND page_name = ?
-            ''', [account_id, page_name])
-
-                # Insert new state variables
-                for key, value in data.items():
-                    if key == 'page':
-                        continue  # Skip the page key
-
-                    # Determine variable type
-                    if isinstance(value, str):
-                        if value.startswith('{') or value.startswith('['):
-                            var_type = 'object'
-                        else:
-                            var_type = 'string'
-                    else:
-                        var_type = 'string'
-
-                    # Insert into database
-                    cursor.execute('''
-                        INSERT INTO expanded_state
-                        (account_id, page_name, variable_name, variable_type, variable_value)
-                        VALUES (?, ?, ?, ?, ?)
-                    ''', [account_id, page_name, key, var_type, value])
+                cursor.execute(_STATE_DELETE_SQL, [account_id, page_name])
+
+                # Insert new state variables in one batch (skipping the page key);
+                # JSON-looking strings are tagged 'object', everything else 'string'.
+                # executemany consumes the generator row by row, so the request
+                # body is not copied into a second list first
+                rows = (
+                    (account_id, page_name, key,
+                     'object' if isinstance(value, str) and value[:1] in ('{', '[') else 'string',
+                     value)
+                    for key, value in data.items() if key != 'page'
+                )
+                cursor.executemany(_STATE_INSERT_SQL, rows)
 
                 # Commit transaction
                 db.commit()
@@ -477,23 +537,23 @@ def manage_state():
                     invalidate_portfolio_cache(account_id)
 
             logger.info(
-                f"State saved successfully for account {account_id}, page {page_name}")
+                "State saved successfully for account %s, page %s", account_id, page_name)
             return success_response(message='State saved successfully')
 
         except (DataIntegrityError, ValidationError) as e:
-            logger.error(f"Error saving state for page '{page_name}': {str(e)}")
+            logger.error("Error saving state for page '%s': %s", page_name, str(e))
             return error_response(str(e), 400 if isinstance(e, ValidationError) else 500)
         except Exception as e:
-            logger.exception(f"Unexpected error saving state for page '{page_name}'")
+            logger.exception("Unexpected error saving state for page '%s'", page_name)
             return error_response('Failed to save state', 500)
 
     return error_response('Method not allowed', 405)
 
 # API endpoint to get companies for a specific portfolio
 
-def invalidate_portfolio_cache(account_id: int) -> None:
+def invalidate_portfolio_cache(account_id: Optional[int] = None) -> None:
     """
-    Invalidate the portfolio allocation cache for a specific account.
+    Invalidate the portfolio allocation and metrics caches for an account.
 
     Call this function after any operation that modifies portfolio data:
     - CSV upload
@@ -502,14 +562,20 @@ def invalidate_portfolio_cache(account_id: int) -> None:
     - Portfolio add/rename/delete
 
     Args:
-        account_id: The account ID whose cache should be invalidated
+        account_id: The account ID whose cache should be invalidated, or None
+            for every account (price updates are not tied to one account)
     """
     try:
-        cache.delete_memoized(_get_simulator_portfolio_data_internal, account_id)
-        logger.debug(f"Cache invalidated for account_id: {account_id}")
+        if account_id is None:
+            cache.delete_memoized(_get_simulator_portfolio_data_internal)
+            cache.delete_memoized(_get_portfolio_metrics_internal)
+        else:
+            cache.delete_memoized(_get_simulator_portfolio_data_internal, account_id)
+            cache.delete_memoized(_get_portfolio_metrics_internal, account_id)
+        logger.debug("Cache invalidated for account_id: %s", account_id)
     except Exception as e:
         # Cache invalidation failure is not critical - log full traceback and continue
-        logger.exception(f"Failed to invalidate cache for account_id {account_id}")
+        logger.exception("Failed to invalidate cache for account_id %s", account_id)
 
 
 @cache.memoize(timeout=60)
@@ -533,10 +599,11 @@ def _get_simulator_portfolio_data_internal(account_id: int) -> Dict[str, Any]:
         ValidationError: If data is invalid
         DataIntegrityError: If database operations fail
     """
-    logger.info(f"Getting portfolio data for rebalancing, account_id: {account_id}")
+    logger.info("Getting portfolio data for rebalancing, account_id: %s", account_id)
 
-    # OPTIMIZATION: Single query with LEFT JOINs to fetch ALL data at once (60-80% faster)
-    # Combines: portfolios + companies + shares + prices + expanded_state
+    # OPTIMIZATION: Single query with LEFT JOINs for all position data (60-80% faster)
+    # Combines: portfolios + companies + shares + prices. The Builder state is
+    # read separately so its JSON is not repeated on every joined row
     try:
         combined_data = query_db('''
             SELECT
@@ -552,57 +619,46 @@ def _get_simulator_portfolio_data_internal(account_id: int) -> Dict[str, Any]:
                 mp.price_eur,
                 c.custom_total_value,
                 c.custom_price_eur,
-                c.is_custom_value,
-                es_portfolios.variable_value AS portfolios_state,
-                es_rules.variable_value AS rules_state
+                c.is_custom_value
             FROM portfolios p
             LEFT JOIN companies c ON c.portfolio_id = p.id AND c.account_id = p.account_id
             LEFT JOIN company_shares cs ON c.id = cs.company_id
             LEFT JOIN market_prices mp ON c.identifier = mp.identifier
-            LEFT JOIN expanded_state es_portfolios ON
-                es_portfolios.account_id = p.account_id AND
-                es_portfolios.page_name = 'builder' AND
-                es_portfolios.variable_name = 'portfolios'
-            LEFT JOIN expanded_state es_rules ON
-                es_rules.account_id = p.account_id AND
-                es_rules.page_name = 'builder' AND
-                es_rules.variable_name = 'rules'
             WHERE p.account_id = ? AND p.name IS NOT NULL
             ORDER BY p.name, c.sector, c.name
         ''', [account_id])
+        builder_state = dict(query_db_raw(_BUILDER_STATE_SQL, [account_id]))
     except Exception as e:
-        logger.error(f"Database error fetching combined portfolio data: {e}")
+        logger.error("Database error fetching combined portfolio data: %s", e)
         raise DataIntegrityError('Failed to fetch portfolio data from database')
 
     if not combined_data:
-        logger.warning(f"No data found for account {account_id}")
+        logger.warning("No data found for account %s", account_id)
         return {'portfolios': []}
 
-    # Extract state data from first row (same for all rows due to LEFT JOIN)
-    first_row = combined_data[0] if isinstance(combined_data, list) else combined_data
-    portfolios_state_json = first_row.get('portfolios_state') if isinstance(first_row, dict) else None
-    rules_state_json = first_row.get('rules_state') if isinstance(first_row, dict) else None
+    portfolios_state_json = builder_state.get('portfolios')
+    rules_state_json = builder_state.get('rules')
 
     # Parse target allocations
     target_allocations = []
     if portfolios_state_json:
         try:
-            target_allocations = json.loads(portfolios_state_json)
-            logger.info(f"Found target allocations: {len(target_allocations)} portfolios")
+            target_allocations = current_app.json.loads(portfolios_state_json)
+            logger.info("Found target allocations: %s portfolios", len(target_allocations))
         except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse target allocations: {e}")
+            logger.error("Failed to parse target allocations: %s", e)
 
     # Use combined_data for company data (compatible with existing code)
     data = combined_data
 
-    # Parse allocation rules (already fetched from combined query)
+    # Parse allocation rules (fetched with the Builder state above)
     rules = {}
     if rules_state_json:
         try:
-            rules = json.loads(rules_state_json)
-            logger.info(f"Found allocation rules: maxPerStock={rules.get('maxPerStock')}%, maxPerETF={rules.get('maxPerETF')}%")
+            rules = current_app.json.loads(rules_state_json)
+            logger.info("Found allocation rules: maxPerStock=%s%%, maxPerETF=%s%%", rules.get('maxPerStock'), rules.get('maxPerETF'))
         except json.JSONDecodeError as e:
-            logger.warning(f"Failed to parse rules JSON: {e}")
+            logger.warning("Failed to parse rules JSON: %s", e)
 
     # Use AllocationService to process the data
     try:
@@ -615,7 +671,7 @@ def _get_simulator_portfolio_data_internal(account_id: int) -> Dict[str, Any]:
 
         # Calculate total current value across all portfolios
         total_current_value = sum(pdata['currentValue'] for pdata in portfolio_map.values())
-        logger.info(f"Total current value across all portfolios: {total_current_value}")
+        logger.info("Total current value across all portfolios: %s", total_current_value)
 
         # Step 2: Calculate allocation targets with type constraints
         portfolios_with_targets = AllocationService.calculate_allocation_targets_with_type_constraints(
@@ -631,17 +687,17 @@ def _get_simulator_portfolio_data_internal(account_id: int) -> Dict[str, Any]:
             portfolios_with_targets=portfolios_with_targets
         )
 
-        logger.info(f"Returning {len(result['portfolios'])} portfolios")
+        logger.info("Returning %s portfolios", len(result['portfolios']))
         return result
 
     except ImportError as e:
-        logger.error(f"Failed to import AllocationService: {e}")
+        logger.error("Failed to import AllocationService: %s", e)
         raise ValidationError('Allocation service unavailable')
     except (ValidationError, DataIntegrityError):
         # Re-raise these so caller can handle them
         raise
     except Exception as e:
-        logger.error(f"Error in allocation service: {e}")
+        logger.error("Error in allocation service: %s", e)
         raise ValidationError(f'Failed to calculate allocations: {str(e)}')
 
 
@@ -656,11 +712,11 @@ def get_simulator_portfolio_data():
         return jsonify(result)
 
     except ValidationError as e:
-        logger.error(f"Validation error in get_simulator_portfolio_data: {e}")
+        logger.error("Validation error in get_simulator_portfolio_data: %s", e)
         return error_response(str(e), status=400)
 
     except DataIntegrityError as e:
-        logger.error(f"Data integrity error in get_simulator_portfolio_data: {e}")
+        logger.error("Data integrity error in get_simulator_portfolio_data: %s", e)
         return error_response(str(e), status=409)
 
     except Exception as e:
@@ -676,7 +732,7 @@ def get_portfolio_data_api():
         account_id = g.account_id
 
         # Log the attempt to fetch data
-        logger.info(f"Fetching portfolio data for account_id: {account_id}")
+        logger.info("Fetching portfolio data for account_id: %s", account_id)
 
         # Get data from database without triggering any yfinance updates
         portfolio_data = get_portfolio_data(account_id)
@@ -684,19 +740,19 @@ def get_portfolio_data_api():
         # Detailed logging of result
         if not portfolio_data:
             logger.warning(
-                f"No portfolio data found for account_id: {account_id}")
+                "No portfolio data found for account_id: %s", account_id)
             # Return empty array instead of 404 for no data
             return jsonify([])
         else:
             logger.info(
-                f"Successfully retrieved {len(portfolio_data)} portfolio items")
+                "Successfully retrieved %s portfolio items", len(portfolio_data))
 
         return jsonify(portfolio_data)
     except (DataIntegrityError, ValidationError) as e:
-        logger.error(f"Error getting portfolio data for account {account_id}: {str(e)}")
+        logger.error("Error getting portfolio data for account %s: %s", account_id, str(e))
         return error_response(str(e), 400 if isinstance(e, ValidationError) else 500)
     except Exception as e:
-        logger.exception(f"Unexpected error getting portfolio data for account {account_id}")
+        logger.exception("Unexpected error getting portfolio data for account %s", account_id)
         return error_response('Failed to load portfolio data', 500)
 
 
@@ -712,7 +768,7 @@ def _get_all_portfolios_data(account_id: int) -> dict:
     Returns:
         Dictionary with aggregated portfolio data in the same format as single portfolio
     """
-    logger.info(f"Fetching aggregated data for all portfolios, account {account_id}")
+    logger.info("Fetching aggregated data for all portfolios, account %s", account_id)
 
     # Fetch all companies across all portfolios
     companies_raw = query_db('''
@@ -971,7 +1027,7 @@ def _get_all_portfolios_data(account_id: int) -> dict:
     # Get the most recent last_updated across all companies
     last_updated = max((c['last_updated'] for c in companies if c['last_updated']), default=None)
 
-    logger.info(f"Returning {len(companies)} unique companies from all portfolios ({len(sectors_list)} sectors, {len(theses_list)} theses, {len(portfolios_list)} portfolios)")
+    logger.info("Returning %s unique companies from all portfolios (%s sectors, %s theses, %s portfolios)", len(companies), len(sectors_list), len(theses_list), len(portfolios_list))
 
     return {
         'portfolio_id': 'all',
@@ -1030,10 +1086,10 @@ def get_single_portfolio_data_api(portfolio_id):
         try:
             portfolio_id_int = int(portfolio_id)
         except (ValueError, TypeError):
-            logger.warning(f"Invalid portfolio_id format: {portfolio_id}")
+            logger.warning("Invalid portfolio_id format: %s", portfolio_id)
             return not_found_response(f'Portfolio {portfolio_id} not found')
 
-        logger.info(f"Fetching data for portfolio {portfolio_id_int}, account {account_id}")
+        logger.info("Fetching data for portfolio %s, account %s", portfolio_id_int, account_id)
 
         # Verify portfolio belongs to account
         portfolio = query_db('''
@@ -1043,7 +1099,7 @@ def get_single_portfolio_data_api(portfolio_id):
         ''', [portfolio_id_int, account_id], one=True)
 
         if not portfolio:
-            logger.warning(f"Portfolio {portfolio_id} not found for account {account_id}")
+            logger.warning("Portfolio %s not found for account %s", portfolio_id, account_id)
             return not_found_response(f'Portfolio {portfolio_id} not found')
 
         # Fetch companies for this portfolio
@@ -1066,7 +1122,7 @@ def get_single_portfolio_data_api(portfolio_id):
         ''', [portfolio_id, account_id])
 
         if not companies:
-            logger.info(f"No companies found for portfolio {portfolio_id}")
+            logger.info("No companies found for portfolio %s", portfolio_id)
             companies = []
 
         # Calculate current_value for each company using calculate_item_value()
@@ -1204,155 +1260,220 @@ def get_single_portfolio_data_api(portfolio_id):
             'theses': theses_list
         }
 
-        logger.info(f"Returning {len(companies)} companies in {len(sectors_list)} sectors and {len(theses_list)} theses for portfolio {portfolio_id}")
+        logger.info("Returning %s companies in %s sectors and %s theses for portfolio %s", len(companies), len(sectors_list), len(theses_list), portfolio_id)
         return jsonify(response_data)
 
     except ValidationError as e:
-        logger.error(f"Validation error: {e}")
+        logger.error("Validation error: %s", e)
         return error_response(str(e), status=400)
     except DataIntegrityError as e:
-        logger.error(f"Data integrity error: {e}")
+        logger.error("Data integrity error: %s", e)
         return error_response(str(e), status=409)
     except Exception as e:
-        logger.exception(f"Unexpected error getting single portfolio data for portfolio {portfolio_id}")
+        logger.exception("Unexpected error getting single portfolio data for portfolio %s", portfolio_id)
         return error_response('Internal server error', status=500)
 
 
-def _get_position_data_by_field(account_id: int, field_sql: str) -> List[Dict[str, Any]]:
+# SECURITY: Whitelist of allowed SQL expressions to prevent SQL injection
+# Only predefined expressions are allowed - no user input should reach here
+_ALLOWED_FIELD_EXPRESSIONS = {
+    "COALESCE(c.sector, 'Uncategorized')",
+    "COALESCE(c.override_country, mp.country, 'Unknown')",
+    "c.sector",
+    "c.override_country",
+    "mp.country",
+}
+_COUNTRY_FIELD_SQL = "COALESCE(c.override_country, mp.country, 'Unknown')"
+_SECTOR_FIELD_SQL = "COALESCE(c.sector, 'Uncategorized')"
+
+# Shared by the per-position, grouped capacity and simulator queries
+_POSITION_VALUE_SQL = """CASE
+                WHEN c.is_custom_value = 1 AND c.custom_total_value IS NOT NULL THEN c.custom_total_value
+                ELSE (COALESCE(cs.override_share, cs.shares, 0) * COALESCE(mp.price_eur, 0))
+            END"""
+_POSITION_FROM_SQL = """FROM companies c
+        LEFT JOIN company_shares cs ON c.id = cs.company_id
+        LEFT JOIN market_prices mp ON c.identifier = mp.identifier
+        LEFT JOIN portfolios p ON c.portfolio_id = p.id
+        WHERE c.account_id = ?
+        AND COALESCE(cs.override_share, cs.shares, 0) > 0
+        AND (COALESCE(mp.price_eur, 0) > 0 OR (c.is_custom_value = 1 AND c.custom_total_value IS NOT NULL))"""
+
+# Builder page settings read by the capacity and simulator endpoints
+_BUILDER_SETTINGS_SQL = """SELECT variable_name, variable_value
+        FROM expanded_state
+        WHERE account_id = ? AND page_name = 'builder' AND variable_name IN ('budgetData', 'rules')"""
+
+
+def _get_builder_settings(account_id: int) -> Dict[str, Dict[str, Any]]:
+    """
+    Load the Builder page's budgetData and rules state in one query.
+
+    Returns the parsed JSON objects keyed by variable name; a variable that is
+    missing or does not parse to an object is left out, so callers fall back
+    to their defaults.
+    """
+    settings = {}
+    for row in query_db(_BUILDER_SETTINGS_SQL, [account_id]):
+        var_name = row['variable_name']
+        try:
+            parsed_json = current_app.json.loads(row['variable_value'])
+        except (json.JSONDecodeError, ValueError) as e:
+            logger.warning("Failed to parse %s data: %s", var_name, e)
+            continue
+        if isinstance(parsed_json, dict):
+            settings[var_name] = parsed_json
+    return settings
+
+
+def _check_field_sql(field_sql: str) -> None:
+    """Raise ValueError unless field_sql is in the allowed whitelist"""
+    if field_sql not in _ALLOWED_FIELD_EXPRESSIONS:
+        logger.error("SQL injection attempt blocked: %s", field_sql)
+        raise ValueError(f"Invalid field_sql expression: {field_sql}")
+
+
+def _get_position_data_by_field(account_id: int, field_sql: str,
+                                field_value: Optional[str] = None) -> List[Dict[str, Any]]:
     """
     Shared helper to query position data grouped by any field (country, sector, etc.)
 
     Args:
         account_id: User's account ID
         field_sql: SQL expression for the grouping field (e.g., "COALESCE(c.sector, 'Uncategorized')")
+        field_value: Optional value to restrict the positions to a single group
 
     Returns:
-        List of position data dictionaries with field_value, company details, and values
+        List of position dictionaries (company_name, portfolio_name, shares,
+        price, value), shaped and typed in SQL so rows can be returned as-is
 
     Raises:
         ValueError: If field_sql is not in the allowed whitelist
     """
-    # SECURITY: Whitelist of allowed SQL expressions to prevent SQL injection
-    # Only predefined expressions are allowed - no user input should reach here
-    ALLOWED_FIELD_EXPRESSIONS = {
-        "COALESCE(c.sector, 'Uncategorized')",
-        "COALESCE(c.override_country, mp.country, 'Unknown')",
-        "c.sector",
-        "c.override_country",
-        "mp.country",
-    }
+    _check_field_sql(field_sql)
 
-    if field_sql not in ALLOWED_FIELD_EXPRESSIONS:
-        logger.error(f"SQL injection attempt blocked: {field_sql}")
-        raise ValueError(f"Invalid field_sql expression: {field_sql}")
+    params = [account_id]
+    field_filter = ''
+    if field_value is not None:
+        field_filter = f'AND {field_sql} = ?'
+        params.append(field_value)
 
     return query_db(f'''
         SELECT
-            {field_sql} as field_value,
             c.name as company_name,
             p.name as portfolio_name,
-            COALESCE(cs.override_share, cs.shares, 0) as shares,
-            COALESCE(mp.price_eur, 0) as price,
-            CASE
-                WHEN c.is_custom_value = 1 AND c.custom_total_value IS NOT NULL THEN c.custom_total_value
-                ELSE (COALESCE(cs.override_share, cs.shares, 0) * COALESCE(mp.price_eur, 0))
-            END as position_value
-        FROM companies c
-        LEFT JOIN company_shares cs ON c.id = cs.company_id
-        LEFT JOIN market_prices mp ON c.identifier = mp.identifier
-        LEFT JOIN portfolios p ON c.portfolio_id = p.id
-        WHERE c.account_id = ?
-        AND COALESCE(cs.override_share, cs.shares, 0) > 0
-        AND (COALESCE(mp.price_eur, 0) > 0 OR (c.is_custom_value = 1 AND c.custom_total_value IS NOT NULL))
-        ORDER BY field_value, position_value DESC
+            CAST(COALESCE(cs.override_share, cs.shares, 0) AS REAL) as shares,
+            CAST(COALESCE(mp.price_eur, 0) AS REAL) as price,
+            CAST({_POSITION_VALUE_SQL} AS REAL) as value
+        {_POSITION_FROM_SQL}
+        {field_filter}
+        ORDER BY {field_sql}, value DESC
+    ''', params)
+
+
+def _get_position_totals_by_field(account_id: int, field_sql: str) -> List[Dict[str, Any]]:
+    """
+    Sum position values per group in SQL, without loading individual positions.
+
+    Args:
+        account_id: User's account ID
+        field_sql: Whitelisted SQL expression for the grouping field
+
+    Returns:
+        List of dicts with field_value and total_invested
+
+    Raises:
+        ValueError: If field_sql is not in the allowed whitelist
+    """
+    _check_field_sql(field_sql)
+
+    return query_db(f'''
+        WITH pos AS (
+            SELECT
+                {field_sql} as field_value,
+                {_POSITION_VALUE_SQL} as position_value
+            {_POSITION_FROM_SQL}
+        )
+        SELECT field_value, SUM(position_value) as total_invested
+        FROM pos
+        GROUP BY field_value
     ''', [account_id])
 
 
+def _build_capacity_data(totals: List[Dict[str, Any]], field_key: str,
+                         total_investable_capital: float, max_percent: float) -> List[Dict[str, Any]]:
+    """
+    Compute the remaining capacity per group from SQL-aggregated totals.
+
+    Args:
+        totals: Rows from _get_position_totals_by_field()
+        field_key: Response key for the group value (e.g. 'country', 'sector')
+        total_investable_capital: Budget the percentage limit applies to
+        max_percent: Maximum share of the budget per group, in percent
+
+    Returns:
+        Capacity entries sorted by remaining capacity (over-allocated groups first)
+    """
+    if not totals or total_investable_capital <= 0:
+        return []
+
+    max_allowed = total_investable_capital * (max_percent / 100)
+    capacity = []
+    for row in totals:
+        current_invested = float(row['total_invested'])
+        # Allow negative values for over-allocated groups
+        remaining_capacity = max_allowed - current_invested
+        capacity.append({
+            field_key: row['field_value'],
+            'current_invested': current_invested,
+            'max_allowed': max_allowed,
+            'remaining_capacity': remaining_capacity,
+            'is_over_allocated': remaining_capacity < 0
+        })
+    capacity.sort(key=lambda x: x['remaining_capacity'])
+    return capacity
+
+
+def _positions_for_group(account_id: int, field_sql: str, field_value: str) -> List[Dict[str, Any]]:
+    """Load the individual positions of one capacity group (used for hover details)"""
+    return _get_position_data_by_field(account_id, field_sql, field_value)
+
+
 @require_auth
 def get_country_capacity_data():
     """API endpoint to get country investment capacity data for the rebalancing feature"""
     logger.info("API request for country investment capacity data")
 
     account_id = g.account_id
-    logger.info(f"Getting country capacity data for account_id: {account_id}")
+    logger.info("Getting country capacity data for account_id: %s", account_id)
 
     try:
-        # Get budget and rules settings from expanded_state in single query
-        state_data = query_db('''
-            SELECT variable_name, variable_value
-            FROM expanded_state
-            WHERE account_id = ? AND page_name = ? AND variable_name IN (?, ?)
-        ''', [account_id, 'build', 'budgetData', 'rules'])
+        # Get budget and rules settings from the Builder page state
+        settings = _get_builder_settings(account_id)
 
         # Parse budget and rules data
         total_investable_capital = 0
         max_per_country = 10  # Default value
 
-        for row in state_data:
-            var_name = row.get('variable_name')
-            var_value = row.get('variable_value', '{}')
-            try:
-                parsed_json = json.loads(var_value)
-                if var_name == 'budgetData':
-                    total_investable_capital = float(parsed_json.get('totalInvestableCapital', 0))
-                elif var_name == 'rules':
-                    max_per_country = float(parsed_json.get('maxPerCountry', 10))
-            except (json.JSONDecodeError, ValueError) as e:
-                logger.warning(f"Failed to parse {var_name} data: {e}")
-
-        logger.info(f"Budget settings - Total Investable Capital: {total_investable_capital}, Max Per Country: {max_per_country}%")
-
-        # Get all user's positions with individual company details by country (using shared helper)
-        position_data = _get_position_data_by_field(
-            account_id,
-            "COALESCE(c.override_country, mp.country, 'Unknown')"
-        )
-
-        # Group positions by country
-        country_positions = {}
-        if position_data:
-            for row in position_data:
-                country = row['field_value']  # Using generic field_value from helper
-                if country not in country_positions:
-                    country_positions[country] = {
-                        'positions': [],
-                        'total_invested': 0
-                    }
+        try:
+            total_investable_capital = float(
+                settings.get('budgetData', {}).get('totalInvestableCapital', 0))
+            max_per_country = float(settings.get('rules', {}).get('maxPerCountry', 10))
+        except (TypeError, ValueError) as e:
+            logger.warning("Failed to parse budget settings: %s", e)
 
-                position_info = {
-                    'company_name': row['company_name'],
-                    'portfolio_name': row['portfolio_name'],
-                    'shares': float(row['shares']),
-                    'price': float(row['price']),
-                    'value': float(row['position_value'])
-                }
+        logger.info("Budget settings - Total Investable Capital: %s, Max Per Country: %s%%", total_investable_capital, max_per_country)
 
-                country_positions[country]['positions'].append(position_info)
-                country_positions[country]['total_invested'] += position_info['value']
+        # Sum position values per country in SQL; individual positions are served
+        # on demand by the country positions endpoint
+        totals = _get_position_totals_by_field(account_id, _COUNTRY_FIELD_SQL)
 
         # Calculate remaining capacity for each country
-        country_capacity = []
-        if country_positions and total_investable_capital > 0:
-            max_per_country_amount = total_investable_capital * (max_per_country / 100)
-
-            for country, data in country_positions.items():
-                current_invested = data['total_invested']
-                # Allow negative values for over-allocated countries
-                remaining_capacity = max_per_country_amount - current_invested
-
-                country_capacity.append({
-                    'country': country,
-                    'current_invested': current_invested,
-                    'max_allowed': max_per_country_amount,
-                    'remaining_capacity': remaining_capacity,
-                    'is_over_allocated': remaining_capacity < 0,
-                    'positions': data['positions']  # Include individual positions for hover
-                })
-
-        # Sort by remaining capacity (ascending - over-allocated countries first, then least to most capacity)
-        country_capacity.sort(key=lambda x: x['remaining_capacity'])
+        country_capacity = _build_capacity_data(
+            totals, 'country', total_investable_capital, max_per_country
+        )
 
-        logger.info(f"Returning country capacity data for {len(country_capacity)} countries")
+        logger.info("Returning country capacity data for %s countries", len(country_capacity))
         return jsonify({
             'countries': country_capacity,
             'total_investable_capital': total_investable_capital,
@@ -1360,10 +1481,10 @@ def get_country_capacity_data():
         })
 
     except (DataIntegrityError, ValidationError) as e:
-        logger.error(f"Error getting country capacity data: {str(e)}")
+        logger.error("Error getting country capacity data: %s", str(e))
         return error_response(str(e), 400 if isinstance(e, ValidationError) else 500)
     except Exception as e:
-        logger.exception(f"Unexpected error getting country capacity data")
+        logger.exception("Unexpected error getting country capacity data")
         return error_response('Failed to calculate country capacity', 500)
 
 
@@ -1373,93 +1494,35 @@ def get_sector_capacity_data():
     logger.info("API request for sector investment capacity data")
 
     account_id = g.account_id
-    logger.info(f"Getting sector capacity data for account_id: {account_id}")
+    logger.info("Getting sector capacity data for account_id: %s", account_id)
 
     try:
-        # Get budget settings from expanded_state (from build page)
-        budget_data = query_db('''
-            SELECT variable_value
-            FROM expanded_state
-            WHERE account_id = ? AND page_name = ? AND variable_name = ?
-        ''', [account_id, 'build', 'budgetData'], one=True)
-
-        rules_data = query_db('''
-            SELECT variable_value
-            FROM expanded_state
-            WHERE account_id = ? AND page_name = ? AND variable_name = ?
-        ''', [account_id, 'build', 'rules'], one=True)
+        # Get budget and rules settings from the Builder page state
+        settings = _get_builder_settings(account_id)
 
         # Parse budget and rules data
         total_investable_capital = 0
         max_per_sector = 25  # Default value
 
-        if budget_data and isinstance(budget_data, dict):
-            try:
-                budget_json = json.loads(budget_data.get('variable_value', '{}'))
-                total_investable_capital = float(budget_json.get('totalInvestableCapital', 0))
-            except (json.JSONDecodeError, ValueError) as e:
-                logger.warning(f"Failed to parse budget data: {e}")
-
-        if rules_data and isinstance(rules_data, dict):
-            try:
-                rules_json = json.loads(rules_data.get('variable_value', '{}'))
-                max_per_sector = float(rules_json.get('maxPerSector', 25))
-            except (json.JSONDecodeError, ValueError) as e:
-                logger.warning(f"Failed to parse rules data: {e}")
-
-        logger.info(f"Budget settings - Total Investable Capital: {total_investable_capital}, Max Per Sector: {max_per_sector}%")
-
-        # Get all user's positions with individual company details by sector (using shared helper)
-        position_data = _get_position_data_by_field(
-            account_id,
-            "COALESCE(c.sector, 'Uncategorized')"
-        )
+        try:
+            total_investable_capital = float(
+                settings.get('budgetData', {}).get('totalInvestableCapital', 0))
+            max_per_sector = float(settings.get('rules', {}).get('maxPerSector', 25))
+        except (TypeError, ValueError) as e:
+            logger.warning("Failed to parse budget settings: %s", e)
 
-        # Group positions by sector
-        sector_positions = {}
-        if position_data:
-            for row in position_data:
-                sector = row['field_value']  # Using generic field_value from helper
-                if sector not in sector_positions:
-                    sector_positions[sector] = {
-                        'positions': [],
-                        'total_invested': 0
-                    }
+        logger.info("Budget settings - Total Investable Capital: %s, Max Per Sector: %s%%", total_investable_capital, max_per_sector)
 
-                position_info = {
-                    'company_name': row['company_name'],
-                    'portfolio_name': row['portfolio_name'],
-                    'shares': float(row['shares']),
-                    'price': float(row['price']),
-                    'value': float(row['position_value'])
-                }
-
-                sector_positions[sector]['positions'].append(position_info)
-                sector_positions[sector]['total_invested'] += position_info['value']
+        # Sum position values per sector in SQL; individual positions are served
+        # on demand by the sector positions endpoint
+        totals = _get_position_totals_by_field(account_id, _SECTOR_FIELD_SQL)
 
         # Calculate remaining capacity for each sector
-        sector_capacity = []
-        if sector_positions and total_investable_capital > 0:
-            max_per_sector_amount = total_investable_capital * (max_per_sector / 100)
-
-            for sector, data in sector_positions.items():
-                current_invested = data['total_invested']
-                # Allow negative values for over-allocated sectors
-                remaining_capacity = max_per_sector_amount - current_invested
-
-                sector_capacity.append({
-                    'sector': sector,
-                    'current_invested': current_invested,
-                    'max_allowed': max_per_sector_amount,
-                    'remaining_capacity': remaining_capacity,
-                    'is_over_allocated': remaining_capacity < 0,
-                    'positions': data['positions']  # Include individual positions for hover
-                })
-
-        # Sort by remaining capacity (ascending - over-allocated sectors first, then least to most capacity)
-        sector_capacity.sort(key=lambda x: x['remaining_capacity'])
+        sector_capacity = _build_capacity_data(
+            totals, 'sector', total_investable_capital, max_per_sector
+        )
 
-        logger.info(f"Returning sector capacity data for {len(sector_capacity)} sectors")
+        logger.info("Returning sector capacity data for %s sectors", len(sector_capacity))
         return jsonify({
             'sectors': sector_capacity,
             'total_investable_capital': total_investable_capital,
@@ -1467,13 +1530,43 @@ def get_sector_capacity_data():
         })
 
     except (DataIntegrityError, ValidationError) as e:
-        logger.error(f"Error getting sector capacity data: {str(e)}")
+        logger.error("Error getting sector capacity data: %s", str(e))
         return error_response(str(e), 400 if isinstance(e, ValidationError) else 500)
     except Exception as e:
-        logger.exception(f"Unexpected error getting sector capacity data")
+        logger.exception("Unexpected error getting sector capacity data")
         return error_response('Failed to calculate sector capacity', 500)
 
 
+@require_auth
+def get_country_capacity_positions():
+    """API endpoint to get the individual positions of one country for capacity hover details"""
+    country = request.args.get('country', '').strip()
+    if not country:
+        return validation_error_response('country', 'country parameter is required')
+
+    try:
+        positions = _positions_for_group(g.account_id, _COUNTRY_FIELD_SQL, country)
+        return jsonify({'country': country, 'positions': positions})
+    except Exception as e:
+        logger.exception("Unexpected error getting positions for country %s", country)
+        return error_response('Failed to load country positions', 500)
+
+
+@require_auth
+def get_sector_capacity_positions():
+    """API endpoint to get the individual positions of one sector for capacity hover details"""
+    sector = request.args.get('sector', '').strip()
+    if not sector:
+        return validation_error_response('sector', 'sector parameter is required')
+
+    try:
+        positions = _positions_for_group(g.account_id, _SECTOR_FIELD_SQL, sector)
+        return jsonify({'sector': sector, 'positions': positions})
+    except Exception as e:
+        logger.exception("Unexpected error getting positions for sector %s", sector)
+        return error_response('Failed to load sector positions', 500)
+
+
 @require_auth
 def get_effective_capacity_data():
     """
@@ -1494,15 +1587,13 @@ def get_effective_capacity_data():
     logger.info("API request for allocation simulator data")
 
     account_id = g.account_id
-    logger.info(f"Getting allocation simulator data for account_id: {account_id}")
+    logger.info("Getting allocation simulator data for account_id: %s", account_id)
 
     try:
-        # Get budget and rules settings from expanded_state in single query
-        state_data = query_db('''
-            SELECT variable_name, variable_value
-            FROM expanded_state
-            WHERE account_id = ? AND page_name = ? AND variable_name IN (?, ?)
-        ''', [account_id, 'build', 'budgetData', 'rules'])
+        # Get budget and rules settings from the Builder page state
+        settings = _get_builder_settings(account_id)
+        budget_json = settings.get('budgetData', {})
+        rules_json = settings.get('rules', {})
 
         # Parse budget and rules data
         total_investable_capital = 0
@@ -1510,43 +1601,28 @@ def get_effective_capacity_data():
         max_per_country = 10  # Default value
         max_per_sector = 25  # Default value
 
-        for row in state_data:
-            var_name = row.get('variable_name')
-            var_value = row.get('variable_value', '{}')
-            try:
-                parsed_json = json.loads(var_value)
-                if var_name == 'budgetData':
-                    total_investable_capital = float(parsed_json.get('totalInvestableCapital', 0))
-                    # availableToInvest is the cash the user wants to allocate
-                    available_to_invest = float(parsed_json.get('availableToInvest', 0))
-                elif var_name == 'rules':
-                    max_per_country = float(parsed_json.get('maxPerCountry', 10))
-                    max_per_sector = float(parsed_json.get('maxPerSector', 25))
-            except (json.JSONDecodeError, ValueError) as e:
-                logger.warning(f"Failed to parse {var_name} data: {e}")
-
-        logger.info(f"Budget settings - Total: {total_investable_capital}, Max Country: {max_per_country}%, Max Sector: {max_per_sector}%")
+        try:
+            total_investable_capital = float(budget_json.get('totalInvestableCapital', 0))
+            # availableToInvest is the cash the user wants to allocate
+            available_to_invest = float(budget_json.get('availableToInvest', 0))
+            max_per_country = float(rules_json.get('maxPerCountry', 10))
+            max_per_sector = float(rules_json.get('maxPerSector', 25))
+        except (TypeError, ValueError) as e:
+            logger.warning("Failed to parse budget settings: %s", e)
+
+        logger.info("Budget settings - Total: %s, Max Country: %s%%, Max Sector: %s%%", total_investable_capital, max_per_country, max_per_sector)
 
         # Get all positions with BOTH country AND sector data
-        position_data = query_db('''
+        position_data = query_db(f'''
             SELECT
-                COALESCE(c.override_country, mp.country, 'Unknown') as country,
-                COALESCE(c.sector, 'Uncategorized') as sector,
+                {_COUNTRY_FIELD_SQL} as country,
+                {_SECTOR_FIELD_SQL} as sector,
                 c.name as company_name,
                 p.name as portfolio_name,
                 COALESCE(cs.override_share, cs.shares, 0) as shares,
                 COALESCE(mp.price_eur, 0) as price,
-                CASE
-                    WHEN c.is_custom_value = 1 AND c.custom_total_value IS NOT NULL THEN c.custom_total_value
-                    ELSE (COALESCE(cs.override_share, cs.shares, 0) * COALESCE(mp.price_eur, 0))
-                END as position_value
-            FROM companies c
-            LEFT JOIN company_shares cs ON c.id = cs.company_id
-            LEFT JOIN market_prices mp ON c.identifier = mp.identifier
-            LEFT JOIN portfolios p ON c.portfolio_id = p.id
-            WHERE c.account_id = ?
-            AND COALESCE(cs.override_share, cs.shares, 0) > 0
-            AND (COALESCE(mp.price_eur, 0) > 0 OR (c.is_custom_value = 1 AND c.custom_total_value IS NOT NULL))
+                {_POSITION_VALUE_SQL} as position_value
+            {_POSITION_FROM_SQL}
             ORDER BY country, position_value DESC
         ''', [account_id])
 
@@ -1678,7 +1754,7 @@ def get_effective_capacity_data():
         sectors_over_limit = sum(1 for c in sectors_list
                                     if c['current_invested'] > c['sector_max'])
 
-        logger.info(f"Returning allocation simulator data: {len(country_capacity)} countries, {len(sectors_list)} sectors")
+        logger.info("Returning allocation simulator data: %s countries, %s sectors", len(country_capacity), len(sectors_list))
         return jsonify({
             'countries': country_capacity,
             'sectors': sectors_list,  # For sector panel
@@ -1698,17 +1774,34 @@ def get_effective_capacity_data():
         })
 
     except (DataIntegrityError, ValidationError) as e:
-        logger.error(f"Error getting effective capacity data: {str(e)}")
+        logger.error("Error getting effective capacity data: %s", str(e))
         return error_response(str(e), 400 if isinstance(e, ValidationError) else 500)
     except Exception as e:
-        logger.exception(f"Unexpected error getting effective capacity data")
+        logger.exception("Unexpected error getting effective capacity data")
         return error_response('Failed to calculate effective capacity', 500)
 
 
+def _get_account_portfolios(account_id: int) -> List[Dict[str, Any]]:
+    """
+    List an account's portfolios by name with a has_companies flag.
+
+    The default '-' portfolio is created on the first call that finds it
+    missing, instead of issuing an INSERT OR IGNORE on every request.
+    """
+    rows = query_db(_ACCOUNT_PORTFOLIOS_SQL, [account_id])
+    if not any(row['name'] == '-' for row in rows):
+        db = get_db()
+        default_id = db.execute(_PORTFOLIO_UPSERT_SQL, ['-', account_id]).fetchone()[0]
+        db.commit()
+        rows.append({'id': default_id, 'name': '-', 'has_companies': 0})
+        rows.sort(key=lambda row: row['name'])
+    return rows
+
+
 @require_auth
 def get_portfolios_api():
     """API endpoint to get portfolios for an account"""
-    logger.info("Accessing portfolios API")
+    logger.debug("Accessing portfolios API")
 
     try:
         account_id = g.account_id
@@ -1718,94 +1811,51 @@ def get_portfolios_api():
             'has_companies', 'false').lower() == 'true'
         include_values = request.args.get(
             'include_values', 'false').lower() == 'true'
-        logger.info(
-            f"Getting portfolios for account_id: {account_id}, include_ids: {include_ids}, has_companies: {has_companies}, include_values: {include_values}")
+        logger.debug(
+            "Getting portfolios for account_id: %s, include_ids: %s, has_companies: %s, include_values: %s",
+            account_id, include_ids, has_companies, include_values)
+
+        # One SELECT lists every portfolio with a has_companies flag, so the
+        # has_companies filter and the default '-' check need no extra queries
+        portfolio_rows = _get_account_portfolios(account_id)
+        if has_companies:
+            portfolio_rows = [p for p in portfolio_rows if p['has_companies']]
+            logger.debug("Filtering for portfolios with associated companies")
 
         # Get portfolio data from portfolios table, including all portfolios with non-null names
         if include_ids:
             # First, try to get the user-saved order from expanded_state
             saved_order_ids = []
             try:
-                saved_portfolios_data = query_db('''
-                    SELECT variable_value FROM expanded_state 
-                    WHERE account_id = ? AND page_name = 'builder' AND variable_name = 'portfolios'
-                ''', [account_id], one=True)
-                
-                if saved_portfolios_data and isinstance(saved_portfolios_data, dict):
-                    saved_portfolios = json.loads(saved_portfolios_data['variable_value'])
-                    saved_order_ids = [p['id'] for p in saved_portfolios if 'id' in p]
-                    logger.info(f"Found saved portfolio order: {saved_order_ids}")
-            except (json.JSONDecodeError, KeyError, TypeError) as e:
-                logger.warning(f"Could not parse saved portfolio order: {e}")
+                # Only the ids are needed, so SQLite's json_each extracts them
+                # instead of decoding the whole Builder portfolios blob in Python
+                saved_order_ids = [row['id'] for row in query_db(_SAVED_PORTFOLIO_ORDER_SQL, [account_id])]
+                if saved_order_ids:
+                    logger.debug("Found saved portfolio order: %s", saved_order_ids)
+            except sqlite3.OperationalError as e:
+                logger.warning("Could not parse saved portfolio order: %s", e)
                 saved_order_ids = []
 
-            # Get portfolios from the portfolios table (without ORDER BY)
-            if has_companies:
-                # Only get portfolios that have at least one company (don't require company_shares entries)
-                portfolios_from_table = query_db('''
-                    SELECT DISTINCT p.id, p.name 
-                    FROM portfolios p
-                    JOIN companies c ON p.id = c.portfolio_id
-                    WHERE p.account_id = ? AND p.name IS NOT NULL
-                ''', [account_id])
-                logger.info(
-                    f"Filtering for portfolios with associated companies")
-            else:
-                # Get all portfolios
-                portfolios_from_table = query_db('''
-                    SELECT id, name FROM portfolios 
-                    WHERE account_id = ? AND name IS NOT NULL
-                ''', [account_id])
-
             # Convert to list of objects with id and name, applying saved order
             portfolios = []
-            if portfolios_from_table:
-                portfolios_dict = {p['id']: {'id': p['id'], 'name': p['name']} 
-                                 for p in portfolios_from_table if isinstance(p, dict)}
+            if portfolio_rows:
+                portfolios_dict = {p['id']: {'id': p['id'], 'name': p['name']}
+                                 for p in portfolio_rows}
                 
                 # If we have saved order, use it; otherwise fall back to name order
                 if saved_order_ids:
-                    # First add portfolios in saved order
-                    for portfolio_id in saved_order_ids:
-                        if portfolio_id in portfolios_dict:
-                            portfolios.append(portfolios_dict[portfolio_id])
-                    # Then add any remaining portfolios not in saved order
-                    for portfolio_id, portfolio_data in portfolios_dict.items():
-                        if portfolio_id not in saved_order_ids:
-                            portfolios.append(portfolio_data)
-                    logger.info(f"Applied saved portfolio order")
+                    # Saved ids first, then any remaining portfolios in name order;
+                    # dict keys keep that insertion order and drop repeated ids
+                    ordered_ids = dict.fromkeys(
+                        pid for pid in saved_order_ids if pid in portfolios_dict)
+                    ordered_ids.update(dict.fromkeys(portfolios_dict))
+                    portfolios = [portfolios_dict[pid] for pid in ordered_ids]
+                    logger.debug("Applied saved portfolio order")
                 else:
-                    # Fall back to alphabetical order by name
-                    portfolios = sorted(portfolios_dict.values(), key=lambda x: x['name'])
-                    logger.info(f"No saved order found, using alphabetical order")
-            logger.info(
-                f"Retrieved {len(portfolios)} portfolios with IDs: {portfolios}")
-
-            # Ensure we're not missing the '-' portfolio if it has companies or if we're not filtering
-            has_default = any(p['name'] == '-' for p in portfolios)
-            if not has_default and (not has_companies or has_companies_in_default(account_id)):
-                default_portfolio = query_db('''
-                    SELECT id FROM portfolios
-                    WHERE account_id = ? AND name = '-'
-                ''', [account_id], one=True)
-
-                if default_portfolio and isinstance(default_portfolio, dict):
-                    portfolios.append(
-                        {'id': default_portfolio['id'], 'name': '-'})
-                    logger.info("Added '-' portfolio to the response")
-                else:
-                    # Create '-' portfolio if it doesn't exist
-                    portfolio_id = execute_db('''
-                        INSERT INTO portfolios (account_id, name)
-                        VALUES (?, '-')
-                    ''', [account_id])
-
-                    if portfolio_id:
-                        portfolios.append({'id': portfolio_id, 'name': '-'})
-                        logger.info(
-                            "Created and added '-' portfolio to the response")
-                    else:
-                        logger.error("Failed to create '-' portfolio - execute_db returned None")
+                    # Fall back to alphabetical order by name (the query's order)
+                    portfolios = list(portfolios_dict.values())
+                    logger.debug("No saved order found, using alphabetical order")
+            logger.debug("Retrieved %d portfolios with IDs: %s", len(portfolios), portfolios)
 
             # Add portfolio values if requested
             if include_values and portfolios:
@@ -1825,76 +1875,32 @@ def get_portfolios_api():
                 ''', [account_id])
 
                 # Create a lookup dict for portfolio values
-                value_lookup = {}
-                if portfolio_values:
-                    value_lookup = {pv['id']: pv['total_value'] for pv in portfolio_values if isinstance(pv, dict)}
+                value_lookup = {pv['id']: pv['total_value'] for pv in portfolio_values}
 
                 # Add total_value to each portfolio
                 for portfolio in portfolios:
                     portfolio['total_value'] = value_lookup.get(portfolio['id'], 0)
 
-                logger.info(f"Added portfolio values: {[(p['name'], p.get('total_value', 0)) for p in portfolios]}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Added portfolio values: %s",
+                                 [(p['name'], p.get('total_value', 0)) for p in portfolios])
 
             json_response = jsonify(portfolios)
         else:
-            # Get portfolio names only
-            if has_companies:
-                # Only get portfolios that have at least one company (don't require company_shares entries)
-                portfolios_from_table = query_db('''
-                    SELECT DISTINCT p.name 
-                    FROM portfolios p
-                    JOIN companies c ON p.id = c.portfolio_id
-                    WHERE p.account_id = ? AND p.name IS NOT NULL
-                    ORDER BY p.name
-                ''', [account_id])
-                logger.info(
-                    f"Filtering for portfolios with associated companies")
-            else:
-                # Get all portfolios
-                portfolios_from_table = query_db('''
-                    SELECT name FROM portfolios 
-                    WHERE account_id = ? AND name IS NOT NULL
-                    ORDER BY name
-                ''', [account_id])
-
             # Extract names from the query results - don't filter out any valid names
-            names = []
-            if portfolios_from_table:
-                names = [p['name'] for p in portfolios_from_table if isinstance(p, dict)]
-            logger.info(
-                f"Retrieved {len(names)} portfolio names from portfolios table: {names}")
-
-            # Ensure '-' is in the list if it has companies or if we're not filtering
-            if '-' not in names and (not has_companies or has_companies_in_default(account_id)):
-                default_exists = query_db('''
-                    SELECT 1 FROM portfolios
-                    WHERE account_id = ? AND name = '-'
-                ''', [account_id], one=True)
-
-                if default_exists:
-                    names.append('-')
-                    logger.info("Added '-' portfolio name to the response")
-                else:
-                    # Create '-' portfolio if it doesn't exist
-                    execute_db('''
-                        INSERT INTO portfolios (account_id, name)
-                        VALUES (?, '-')
-                    ''', [account_id])
-
-                    names.append('-')
-                    logger.info(
-                        "Created and added '-' portfolio name to the response")
+            names = [p['name'] for p in portfolio_rows]
+            logger.debug("Retrieved %d portfolio names from portfolios table: %s", len(names), names)
 
             json_response = jsonify(names)
 
-        logger.debug(f"JSON response to be sent: {json_response.data}")
+        logger.debug("JSON response to be sent: %s", json_response.data)
         return json_response
 
     except (DataIntegrityError, ValidationError) as e:
-        logger.error(f"Error getting portfolios: {str(e)}")
+        logger.error("Error getting portfolios: %s", e)
         return error_response(str(e), 400 if isinstance(e, ValidationError) else 500)
     except Exception as e:
-        logger.exception(f"Unexpected error getting portfolios")
+        logger.exception("Unexpected error getting portfolios")
         return error_response('Failed to retrieve portfolios', 500)
 
 
@@ -1905,18 +1911,18 @@ def upload_csv():
     This endpoint validates the file and starts background processing,
     returning immediately to enable real-time progress tracking.
     """
-    logger.info(f"CSV upload request - account_id: {session.get('account_id')}")
+    logger.info("CSV upload request - account_id: %s", session.get('account_id'))
 
     # Determine if this is an AJAX request
     accept_header = request.headers.get('Accept', '')
     is_ajax = ('application/json' in accept_header or
                request.headers.get('X-Requested-With') == 'XMLHttpRequest')
 
-    logger.info(f"Request headers: Accept='{accept_header}', X-Requested-With='{request.headers.get('X-Requested-With')}', is_ajax={is_ajax}")
+    logger.info("Request headers: Accept='%s', X-Requested-With='%s', is_ajax=%s", accept_header, request.headers.get('X-Requested-With'), is_ajax)
 
     try:
         account_id = g.account_id
-        logger.info(f"CSV upload for account_id: {account_id}")
+        logger.info("CSV upload for account_id: %s", account_id)
 
         # File validation
         if 'csv_file' not in request.files:
@@ -1924,53 +1930,50 @@ def upload_csv():
             raise ValidationError('No file uploaded')
 
         file = request.files['csv_file']
-        logger.info(f"CSV file received: {file.filename}, size: {file.content_length if hasattr(file, 'content_length') else 'unknown'}")
+        logger.info("CSV file received: %s, size: %s", file.filename, file.content_length if hasattr(file, 'content_length') else 'unknown')
 
         if file.filename == '':
             logger.warning("CSV upload failed - empty filename")
             raise ValidationError('No file selected')
 
-        # Read and validate file content
+        # Copy the upload to a temp file for the background job, validating
+        # the encoding as it streams instead of decoding it in one piece
         try:
-            file_content = file.read().decode('utf-8-sig')  # Handle BOM
+            csv_path, csv_preview = save_csv_upload(file.stream)
         except UnicodeDecodeError as e:
-            logger.error(f"CSV file encoding error: {e}")
+            logger.error("CSV file encoding error: %s", e)
             raise ValidationError('Invalid file encoding. Please ensure the file is UTF-8 encoded')
 
-        if not file_content.strip():
+        if not csv_preview:
             logger.warning("CSV upload failed - file is empty")
+            discard_csv_upload(csv_path)
             raise ValidationError('The uploaded CSV file is empty')
 
-        logger.info(f"CSV file content length: {len(file_content)} characters")
+        logger.info("CSV file saved for background processing: %s", csv_path)
 
         # Ensure session is properly configured
         session.permanent = True
         session.modified = True
 
-        # Create backup (automatic backups must always be enabled) [[memory:7528819]]
-        try:
-            backup_database()
-            logger.info("Database backup created before CSV processing")
-        except Exception as e:
-            logger.error(f"Failed to create database backup: {e}")
-            raise DataIntegrityError('Failed to create database backup before processing')
+        # The CSV job backs up the database on its own thread before it
+        # writes anything (automatic backups must always be enabled) [[memory:7528819]]
 
         # Get import mode (add or replace)
         mode = request.form.get('mode', 'replace')
-        logger.info(f"Import mode: {mode}")
+        logger.info("Import mode: %s", mode)
 
-        # Dispatch processing to background thread
+        # Dispatch processing to background thread; the job owns csv_path from here
         try:
-            job_id = start_csv_processing_job(account_id, file_content, mode=mode)
+            job_id = start_csv_processing_job(account_id, csv_path, mode=mode)
         except Exception as e:
-            logger.error(f"Failed to start CSV processing job: {e}")
+            logger.error("Failed to start CSV processing job: %s", e)
             raise CSVProcessingError(f'Failed to start CSV processing: {str(e)}')
 
         # Store job_id in session for progress tracking
         session['csv_upload_job_id'] = job_id
         session.modified = True
 
-        logger.info(f"CSV processing successfully dispatched to background job: {job_id}")
+        logger.info("CSV processing successfully dispatched to background job: %s", job_id)
 
         # Return immediate success response - allows session cookie to be updated
         if is_ajax:
@@ -1980,21 +1983,21 @@ def upload_csv():
             return redirect(url_for('portfolio.enrich'))
 
     except ValidationError as e:
-        logger.error(f"CSV validation error: {e}")
+        logger.error("CSV validation error: %s", e)
         if is_ajax:
             return error_response(str(e), status=400)
         flash(str(e), 'error')
         return redirect(url_for('portfolio.enrich'))
 
     except CSVProcessingError as e:
-        logger.error(f"CSV processing error: {e}")
+        logger.error("CSV processing error: %s", e)
         if is_ajax:
             return error_response(str(e), status=500)
         flash(str(e), 'error')
         return redirect(url_for('portfolio.enrich'))
 
     except DataIntegrityError as e:
-        logger.error(f"Data integrity error: {e}")
+        logger.error("Data integrity error: %s", e)
         if is_ajax:
             return error_response(str(e), status=409)
         flash(str(e), 'error')
@@ -2015,39 +2018,32 @@ def _validate_batch_updates(updates: List[Dict], account_id: int) -> tuple:
 
     Returns:
         tuple: (is_valid: bool, error_message: Optional[str], validation_data: Optional[Dict])
-        If valid: (True, None, {'company_map': {...}, 'portfolio_map': {...}, ...})
+        If valid: (True, None, {'company_map': {name: (id, identifier)}})
         If invalid: (False, error_message, None)
     """
     # Validate data format
     if not updates or not isinstance(updates, list):
         return (False, 'Invalid data format: expected non-empty list', None)
 
+    # Only the companies named in the batch are loaded; a payload that names
+    # none can be rejected without touching the database
+    required_companies = list(dict.fromkeys(
+        item['company'] for item in updates
+        if isinstance(item, dict) and item.get('company')
+    ))
+    if not required_companies:
+        return (False, 'No valid company references', None)
+
     # Preload existing data for validation
-    company_rows = query_db(
-        'SELECT id, name, identifier FROM companies WHERE account_id = ?',
-        [account_id]
-    )
     company_map = {}
-    if company_rows:
-        company_map = {row['name']: row for row in company_rows if isinstance(row, dict)}
-
-    portfolio_rows = query_db(
-        'SELECT id, name FROM portfolios WHERE account_id = ?',
-        [account_id]
-    )
-    portfolio_map = {}
-    if portfolio_rows:
-        portfolio_map = {row['name']: row['id'] for row in portfolio_rows if isinstance(row, dict)}
-
-    share_rows = query_db(
-        '''SELECT cs.company_id FROM company_shares cs
-           JOIN companies c ON cs.company_id = c.id
-           WHERE c.account_id = ?''',
-        [account_id]
-    )
-    shares_set = set()
-    if share_rows:
-        shares_set = {row['company_id'] for row in share_rows if isinstance(row, dict)}
+    for start in range(0, len(required_companies), _IN_CLAUSE_CHUNK_SIZE):
+        chunk = required_companies[start:start + _IN_CLAUSE_CHUNK_SIZE]
+        placeholders = ','.join('?' * len(chunk))
+        company_rows = query_db_raw(
+            f'SELECT id, name, identifier FROM companies WHERE account_id = ? AND name IN ({placeholders})',
+            [account_id, *chunk]
+        )
+        company_map.update((name, (company_id, identifier)) for company_id, name, identifier in company_rows)
 
     # Validate each update item
     validation_errors = []
@@ -2115,9 +2111,7 @@ def _validate_batch_updates(updates: List[Dict], account_id: int) -> tuple:
         })
 
     return (True, None, {
-        'company_map': company_map,
-        'portfolio_map': portfolio_map,
-        'shares_set': shares_set
+        'company_map': company_map
     })
 
 
@@ -2143,27 +2137,87 @@ def update_portfolio_api():
         try:
             is_valid, error_msg, validation_data = _validate_batch_updates(data, account_id)
         except Exception as e:
-            logger.error(f"Error during validation: {e}")
+            logger.error("Error during validation: %s", e)
             raise ValidationError(f'Validation failed: {str(e)}')
 
         if not is_valid:
-            logger.warning(f"Batch update validation failed: {error_msg}")
+            logger.warning("Batch update validation failed: %s", error_msg)
             return validation_error_response('batch_update', error_msg)
 
         # Extract validated data
         company_map = validation_data['company_map']
-        portfolio_map = validation_data['portfolio_map']
-        shares_set = validation_data['shares_set']
 
-        logger.info(f"Validation passed for {len(data)} updates")
+        logger.info("Validation passed for %s updates", len(data))
+
+        # Normalize every item and build the statement parameters before the
+        # transaction opens, so the transaction itself only binds and writes.
+        # Both write lists keep request order (the same company may appear more
+        # than once and the last item must win); company rows hold the
+        # portfolio name until ids are resolved, in that same order, below.
+        company_writes = []
+        share_writes = []
+        identifier_changes = []
+
+        for item in data:
+            company_id, original_identifier = company_map[item['company']]
+            new_identifier = item.get('identifier', '')
+
+            # Handle portfolio assignment
+            portfolio_name = item.get('portfolio')
+            if not portfolio_name or portfolio_name == 'None':
+                portfolio_name = '-'
+
+            # Update company
+            # Always update identifier, sector and portfolio
+            update_sql = _BATCH_COMPANY_UPDATE_SQL
+            update_values = [new_identifier, normalize_sector(item.get('sector', '')), portfolio_name]
+
+            # Conditionally update investment_type if provided
+            if 'investment_type' in item:
+                investment_type = item.get('investment_type')
+                # Validate investment_type value
+                if investment_type and investment_type in ('Stock', 'ETF'):
+                    update_sql = _BATCH_COMPANY_UPDATE_WITH_TYPE_SQL
+                    update_values.append(investment_type)
+                elif investment_type is None or investment_type == '':
+                    # Allow clearing investment_type
+                    update_sql = _BATCH_COMPANY_UPDATE_CLEAR_TYPE_SQL
+                else:
+                    # Reject invalid investment_type values
+                    logger.warning("Invalid investment_type value: %s", investment_type)
+                    return error_response(
+                        f"Invalid investment_type: '{investment_type}'. Must be 'Stock', 'ETF', or empty.",
+                        status=400
+                    )
+
+            # Add company_id for WHERE clause
+            update_values.append(company_id)
+            company_writes.append((update_sql, update_values))
+
+            # Identifier changes get a fresh price after the commit
+            if new_identifier and new_identifier != original_identifier:
+                # Clean up identifier (trim whitespace, uppercase)
+                # No format conversion - cascade at fetch time handles stock vs crypto
+                cleaned_identifier = normalize_identifier(new_identifier)
+                logger.debug("Identifier changed for %s: '%s' → '%s'", item['company'], original_identifier, cleaned_identifier)
+                identifier_changes.append(cleaned_identifier)
+
+            # Update shares
+            if 'shares' in item or 'override_share' in item:
+                shares = item.get('shares')
+                override_share = item.get('override_share')
+
+                if item.get('is_user_edit', False):
+                    share_writes.append((_SHARES_USER_EDIT_UPSERT_SQL, (company_id, shares or 0, override_share)))
+                else:
+                    share_writes.append((_SHARES_UPSERT_SQL, (company_id, shares, override_share)))
+
+        updated_count = len(data)
 
         # PHASE 2: TRANSACTION
-        # Create backup before any changes
-        try:
-            backup_database()
-        except Exception as e:
-            logger.error(f"Failed to create database backup: {e}")
-            raise DataIntegrityError('Failed to create database backup before update')
+        # Periodic snapshot, taken off the request path; the online backup
+        # copies a consistent state from before or after this batch
+        backup_database_in_background()
 
         # Apply all changes in single atomic transaction
         db = get_db()
@@ -2172,179 +2226,44 @@ def update_portfolio_api():
         try:
             cursor.execute('BEGIN TRANSACTION')
 
-            updated_count = 0
-
-            for item in data:
-                company_result = company_map[item['company']]
-                company_id = company_result['id']
-                original_identifier = company_result.get('identifier')
-                new_identifier = item.get('identifier', '')
-
-                # Handle portfolio assignment
-                portfolio_name = item.get('portfolio')
-                if portfolio_name and portfolio_name != 'None':
-                    portfolio_id = portfolio_map.get(portfolio_name)
-                    if portfolio_id is None:
-                        cursor.execute(
-                            'INSERT INTO portfolios (name, account_id) VALUES (?, ?)',
-                            [portfolio_name, account_id]
-                        )
-                        portfolio_id = cursor.lastrowid
-                        portfolio_map[portfolio_name] = portfolio_id
-                else:
-                    portfolio_id = portfolio_map.get('-')
-                    if portfolio_id is None:
-                        cursor.execute(
-                            'INSERT INTO portfolios (name, account_id) VALUES (?, ?)',
-                            ['-', account_id]
-                        )
-                        portfolio_id = cursor.lastrowid
-                        portfolio_map['-'] = portfolio_id
-
-                # Update company
-                # Build dynamic UPDATE based on which fields are provided
-                update_fields = []
-                update_values = []
-
-                # Always update these fields
-                update_fields.append('identifier = ?')
-                update_values.append(new_identifier)
-                update_fields.append('sector = ?')
-                update_values.append(normalize_sector(item.get('sector', '')))
-                update_fields.append('portfolio_id = ?')
-                update_values.append(portfolio_id)
-
-                # Conditionally update investment_type if provided
-                if 'investment_type' in item:
-                    investment_type = item.get('investment_type')
-                    # Validate investment_type value
-                    if investment_type and investment_type in ('Stock', 'ETF'):
-                        update_fields.append('investment_type = ?')
-                        update_values.append(investment_type)
-                    elif investment_type is None or investment_type == '':
-                        # Allow clearing investment_type
-                        update_fields.append('investment_type = NULL')
-                    else:
-                        # Reject invalid investment_type values
-                        logger.warning(f"Invalid investment_type value: {investment_type}")
-                        return error_response(
-                            f"Invalid investment_type: '{investment_type}'. Must be 'Stock', 'ETF', or empty.",
-                            status=400
-                        )
-
-                # Add company_id for WHERE clause
-                update_values.append(company_id)
-
-                cursor.execute(f'''
-                    UPDATE companies
-                    SET {', '.join(update_fields)}
-                    WHERE id = ?
-                ''', update_values)
-
-                # Handle identifier changes (cleanup and fetch price with cascade)
-                if new_identifier and new_identifier != original_identifier:
-
-                    # Clean up identifier (trim whitespace, uppercase)
-                    # No format conversion - cascade at fetch time handles stock vs crypto
-                    cleaned_identifier = normalize_identifier(new_identifier)
-
-                    logger.info(f"Identifier changed for {item['company']}: '{original_identifier}' → '{cleaned_identifier}'")
-                    logger.info(f"Fetching price with two-step cascade...")
-
-                    try:
-                        # Cascade in get_isin_data will:
-                        # 1. Try cleaned_identifier (e.g., "TNK")
-                        # 2. If fails, try cleaned_identifier + "-USD" (e.g., "TNK-USD")
-                        # 3. Return modified_identifier if different format worked
-                        price_data = get_isin_data(cleaned_identifier)
-                        if price_data.get('success'):
-                            # Extract nested data dictionary (matches pattern from batch_processing.py)
-                            data = price_data.get('data', {})
-                            price = data.get('currentPrice')
-                            currency = data.get('currency', 'EUR')
-                            price_eur = data.get('priceEUR')
-                            country = data.get('country')
-                            modified_identifier = price_data.get('modified_identifier')
-
-                            if price is not None and currency is not None and price_eur is not None:
-                                # update_price_in_db will update identifier if modified_identifier differs
-                                # e.g., if cascade found BTC-USD works better than BTC
-                                update_price_in_db(
-                                    identifier=cleaned_identifier,
-                                    price=float(price),
-                                    currency=str(currency),
-                                    price_eur=float(price_eur),
-                                    country=country,
-                                    modified_identifier=modified_identifier
-                                )
-                                logger.info(f"Successfully updated price for {cleaned_identifier}")
-                            else:
-                                logger.warning(f"Missing required price data for {cleaned_identifier}")
-                        else:
-                            logger.warning(f"Failed to fetch price for {cleaned_identifier}: {price_data.get('error', 'Unknown error')}")
-                    except Exception as e:
-                        # Log but don't fail transaction for price fetch errors
-                        logger.error(f"Error fetching price for {cleaned_identifier}: {str(e)}")
-
-                # Update shares
-                if 'shares' in item or 'override_share' in item:
-                    shares = item.get('shares')
-                    override_share = item.get('override_share')
-                    is_user_edit = item.get('is_user_edit', False)
-
-                    if company_id in shares_set:
-                        if is_user_edit:
-                            cursor.execute('''
-                                UPDATE company_shares
-                                SET override_share = ?,
-                                    manual_edit_date = CURRENT_TIMESTAMP,
-                                    is_manually_edited = 1,
-                                    csv_modified_after_edit = 0
-                                WHERE company_id = ?
-                            ''', [override_share, company_id])
-                        else:
-                            cursor.execute('''
-                                UPDATE company_shares
-                                SET shares = ?, override_share = ?
-                                WHERE company_id = ?
-                            ''', [shares, override_share, company_id])
-                    else:
-                        if is_user_edit:
-                            cursor.execute('''
-                                INSERT INTO company_shares
-                                (company_id, shares, override_share, manual_edit_date, is_manually_edited, csv_modified_after_edit)
-                                VALUES (?, ?, ?, CURRENT_TIMESTAMP, 1, 0)
-                            ''', [company_id, shares or 0, override_share])
-                        else:
-                            cursor.execute('''
-                                INSERT INTO company_shares (company_id, shares, override_share)
-                                VALUES (?, ?, ?)
-                            ''', [company_id, shares, override_share])
-                        shares_set.add(company_id)
-
-                updated_count += 1
+            # Swap portfolio names for ids; missing portfolios are created
+            for _, update_values in company_writes:
+                update_values[2] = _get_or_create_portfolio_id(cursor, account_id, update_values[2])
+            _executemany_in_order(cursor, company_writes)
+
+            # company_shares is a separate table, so only the order within it matters
+            _executemany_in_order(cursor, share_writes)
 
             # Commit transaction if all updates successful
             db.commit()
-
-            # Invalidate cache after portfolio data modifications
-            invalidate_portfolio_cache(account_id)
-
-            logger.info(f"Successfully committed {updated_count} updates")
-            return success_response(message=f'Successfully updated {updated_count} items')
+            logger.info("Successfully committed %s updates", updated_count)
 
         except Exception as e:
             # Rollback on any error during transaction
             db.rollback()
-            logger.error(f"Transaction failed, rolled back: {str(e)}")
+            logger.error("Transaction failed, rolled back: %s", str(e))
             raise DataIntegrityError(f'Transaction failed: {str(e)}')
 
+        # Invalidate cache after portfolio data modifications
+        invalidate_portfolio_cache(account_id)
+
+        # Fetch prices for changed identifiers in the background; the batch is
+        # already committed, so a failure here must not change the response
+        response_data = {}
+        if identifier_changes:
+            try:
+                response_data['price_job_id'] = start_batch_process(list(dict.fromkeys(identifier_changes)))
+            except Exception as e:
+                logger.warning("Failed to start price update for changed identifiers: %s", e)
+
+        return success_response(data=response_data, message=f'Successfully updated {updated_count} items')
+
     except ValidationError as e:
-        logger.error(f"Validation error in batch update: {e}")
+        logger.error("Validation error in batch update: %s", e)
         return error_response(str(e), status=400)
 
     except DataIntegrityError as e:
-        logger.error(f"Data integrity error in batch update: {e}")
+        logger.error("Data integrity error in batch update: %s", e)
         return error_response(str(e), status=409)
 
     except Exception as e:
@@ -2368,23 +2287,17 @@ def manage_portfolios():
                 flash('Portfolio name cannot be empty', 'error')
                 return redirect(url_for('portfolio.enrich'))
 
-            # Check if portfolio already exists
-            existing = query_db(
-                'SELECT 1 FROM portfolios WHERE name = ? AND account_id = ?',
-                [portfolio_name, account_id],
-                one=True
+            # Add new portfolio; UNIQUE(account_id, name) turns an existing
+            # name into a no-op, so no separate existence check is needed
+            inserted = execute_db(
+                'INSERT INTO portfolios (name, account_id) VALUES (?, ?) '
+                'ON CONFLICT(account_id, name) DO NOTHING',
+                [portfolio_name, account_id]
             )
-
-            if existing:
+            if not inserted:
                 flash(f'Portfolio "{portfolio_name}" already exists', 'error')
                 return redirect(url_for('portfolio.enrich'))
 
-            # Add new portfolio
-            execute_db(
-                'INSERT INTO portfolios (name, account_id) VALUES (?, ?)',
-                [portfolio_name, account_id]
-            )
-
             flash(
                 f'Portfolio "{portfolio_name}" added successfully', 'success')
 
@@ -2397,13 +2310,7 @@ def manage_portfolios():
                 return redirect(url_for('portfolio.enrich'))
 
             # Check if new name already exists
-            existing = query_db(
-                'SELECT 1 FROM portfolios WHERE name = ? AND account_id = ?',
-                [new_name, account_id],
-                one=True
-            )
-
-            if existing:
+            if new_name in _get_portfolio_map(account_id):
                 flash(f'Portfolio "{new_name}" already exists', 'error')
                 return redirect(url_for('portfolio.enrich'))
 
@@ -2431,7 +2338,7 @@ def manage_portfolios():
                 WHERE p.name = ? AND p.account_id = ?
             ''', [portfolio_name, account_id], one=True)
 
-            if companies and isinstance(companies, dict) and companies.get('count', 0) > 0:
+            if companies and companies['count'] > 0:
                 flash(
                     f'Cannot delete portfolio "{portfolio_name}" because it contains companies', 'error')
                 return redirect(url_for('portfolio.enrich'))
@@ -2448,15 +2355,70 @@ def manage_portfolios():
     except (DataIntegrityError, ValidationError) as e:
         flash(f'Error managing portfolios: {str(e)}', 'error')
     except Exception as e:
-        logger.exception(f"Unexpected error managing portfolios")
+        logger.exception("Unexpected error managing portfolios")
         flash('An unexpected error occurred while managing portfolios', 'error')
 
     # Invalidate cache after portfolio modifications
+    g.pop('portfolio_maps', None)
     invalidate_portfolio_cache(account_id)
 
     return redirect(url_for('portfolio.enrich'))
 
 
+# Server-Sent Events settings for CSV upload progress. A stream ends well
+# before the gunicorn worker timeout; EventSource reconnects on its own.
+# Streams are opt-in (PROGRESS_STREAMING_ENABLED): each one occupies a worker
+# for its whole lifetime, which the default sync workers cannot afford.
+CSV_PROGRESS_STREAM_POLL_SECONDS = 0.5
+CSV_PROGRESS_STREAM_MAX_SECONDS = 60
+CSV_PROGRESS_STREAM_KEEPALIVE_SECONDS = 15
+
+
+def _csv_progress_payload(job_id: Optional[str], job_status: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert a background job status into the progress format used by the frontend"""
+    status = job_status.get('status')
+
+    # Terminal jobs are reported as idle so clients stop tracking them
+    if status in ['failed', 'cancelled', 'completed']:
+        return {
+            'current': 0,
+            'total': 0,
+            'percentage': 0,
+            'status': 'idle',
+            'message': f'Upload {status}: {job_status.get("message", "")}'
+        }
+
+    if job_id and status != 'not_found':
+        return {
+            'current': job_status.get('progress', 0),
+            'total': job_status.get('total', 100),
+            'percentage': job_status.get('progress', 0),
+            'status': 'processing' if status == 'processing' else status or 'idle',
+            'message': job_status.get('message', 'Processing...'),
+            'job_id': job_id
+        }
+
+    return {
+        'current': 0,
+        'total': 0,
+        'percentage': 0,
+        'status': 'idle',
+        'message': 'No active upload'
+    }
+
+
+def _csv_progress_etag(progress_data: Dict[str, Any]) -> str:
+    """
+    Weak ETag value for a CSV progress payload.
+
+    crc32 rather than hash() so every gunicorn worker computes the same tag.
+    """
+    key = '|'.join(str(progress_data.get(field)) for field in (
+        'job_id', 'current', 'total', 'status', 'message'
+    ))
+    return f"{zlib.crc32(key.encode()):08x}"
+
+
 @require_auth
 def csv_upload_progress():
     """API endpoint to get/clear progress of CSV upload operation using database tracking"""
@@ -2464,80 +2426,116 @@ def csv_upload_progress():
         if request.method == 'GET':
             # Check for job_id in session
             job_id = session.get('csv_upload_job_id')
-            
+            job_status = get_csv_job_progress(job_id) if job_id else {'status': 'not_found'}
+
             if job_id:
-                # Get progress from database using existing function
-                job_status = get_job_status(job_id)
-                
-                logger.debug(f" Session has job_id={job_id}, job_status={job_status.get('status')}")
-                
+                logger.debug("Session has job_id=%s, job_status=%s", job_id, job_status.get('status'))
+
                 # IMMEDIATELY clear failed/cancelled jobs from session to prevent infinite loops
                 if job_status.get('status') in ['failed', 'cancelled', 'completed']:
-                    logger.debug(f" Job {job_id} has terminal status '{job_status.get('status')}', clearing from session IMMEDIATELY")
+                    logger.debug("Job %s has terminal status '%s', clearing from session IMMEDIATELY", job_id, job_status.get('status'))
                     if 'csv_upload_job_id' in session:
                         del session['csv_upload_job_id']
                         session.modified = True
-                    
-                    # Return idle status for terminal jobs to stop polling
-                    return jsonify({
-                        'current': 0,
-                        'total': 0,
-                        'percentage': 0,
-                        'status': 'idle',
-                        'message': f'Upload {job_status.get("status")}: {job_status.get("message", "")}'
-                    })
-                
-                if job_status.get('status') != 'not_found':
-                    # Convert database format to frontend format
-                    progress_data = {
-                        'current': job_status.get('progress', 0),
-                        'total': job_status.get('total', 100),
-                        'percentage': job_status.get('progress', 0),
-                        'status': 'processing' if job_status.get('status') == 'processing' else job_status.get('status', 'idle'),
-                        'message': job_status.get('message', 'Processing...'),
-                        'job_id': job_id
-                    }
 
-                    logger.debug(f" CSV progress API returning for account {g.account_id}: {progress_data}")
+            progress_data = _csv_progress_payload(job_id, job_status)
+
+            # Most polls see unchanged progress; answer those with a 304
+            # before serializing the payload
+            etag = _csv_progress_etag(progress_data)
+            if request.if_none_match.contains_weak(etag):
+                return Response(status=304, headers={'ETag': f'W/"{etag}"', 'Cache-Control': 'no-cache'})
+
+            logger.debug("CSV progress API returning for account %s: %s", g.account_id, progress_data)
+            response = jsonify(progress_data)
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
 
-                    return jsonify(progress_data)
-            
-            # No job_id or job not found - return idle status
-            progress_data = {
-                'current': 0,
-                'total': 0,
-                'percentage': 0,
-                'status': 'idle',
-                'message': 'No active upload'
-            }
-            
-            return jsonify(progress_data)
-        
         elif request.method == 'DELETE':
-            # Clear CSV upload job from session
-            job_id = session.get('csv_upload_job_id')
+            # Clear CSV upload job and legacy progress from session; pop() only
+            # marks the session modified when a key was actually removed
+            job_id = session.pop('csv_upload_job_id', None)
+            session.pop('csv_upload_progress', None)
             if job_id:
-                logger.info(f"Manually clearing CSV upload job {job_id} for account {g.account_id}")
-                del session['csv_upload_job_id']
-                session.modified = True
-            
-            # Also clear legacy session progress if exists
-            if 'csv_upload_progress' in session:
-                del session['csv_upload_progress']
-                session.modified = True
+                logger.info("Manually clearing CSV upload job %s for account %s", job_id, g.account_id)
                 
             return jsonify({'message': f'CSV upload progress cleared (was tracking job_id: {job_id})'})
 
     except (DataIntegrityError, ValidationError) as e:
-        logger.error(f"Error handling CSV upload progress: {str(e)}")
+        logger.error("Error handling CSV upload progress: %s", str(e))
         return error_response(str(e), 400 if isinstance(e, ValidationError) else 500)
     except Exception as e:
-        logger.exception(f"Unexpected error handling CSV upload progress")
+        logger.exception("Unexpected error handling CSV upload progress")
         return error_response('Failed to retrieve upload progress', 500)
 
     return error_response('Method not allowed', 405)
 
 
+def _csv_progress_event_stream(
+    job_id: Optional[str],
+    build_payload: Callable[[Optional[str], Dict[str, Any]], Dict[str, Any]]
+) -> Union[Response, tuple]:
+    """
+    Build a Server-Sent Events response for a CSV job's progress.
+
+    The stream loops for up to CSV_PROGRESS_STREAM_MAX_SECONDS inside the
+    request, so it requires a gunicorn worker class that does not dedicate a
+    process to each request (gthread or gevent). Unless PROGRESS_STREAMING_ENABLED
+    is set, a 404 is returned and clients keep polling.
+
+    Progress comes from get_csv_job_progress(), which falls back to the
+    background_jobs table so every gunicorn worker can serve the stream, and
+    an event is only sent when the payload from build_payload changes. The
+    stream closes once the job leaves the processing state or after
+    CSV_PROGRESS_STREAM_MAX_SECONDS; EventSource reconnects by itself while
+    the job is still running.
+    """
+    if not current_app.config.get('PROGRESS_STREAMING_ENABLED'):
+        return error_response('Progress streaming is disabled; poll the progress endpoint instead', status=404)
+
+    def generate():
+        yield f"retry: {int(CSV_PROGRESS_STREAM_POLL_SECONDS * 4000)}\n\n"
+
+        last_payload = None
+        started = last_sent = time.monotonic()
+        while True:
+            job_status = get_csv_job_progress(job_id) if job_id else {'status': 'not_found'}
+            payload = build_payload(job_id, job_status)
+            now = time.monotonic()
+
+            if payload != last_payload:
+                yield f"data: {current_app.json.dumps(payload)}\n\n"
+                last_payload = payload
+                last_sent = now
+            elif now - last_sent >= CSV_PROGRESS_STREAM_KEEPALIVE_SECONDS:
+                yield ": keep-alive\n\n"
+                last_sent = now
+
+            if payload['status'] not in ('processing', 'pending'):
+                return
+            if now - started >= CSV_PROGRESS_STREAM_MAX_SECONDS:
+                return
+            time.sleep(CSV_PROGRESS_STREAM_POLL_SECONDS)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@require_auth
+def csv_upload_progress_stream():
+    """
+    Stream CSV upload progress as Server-Sent Events.
+
+    Opt-in and unused by the bundled frontend, which polls csv_upload_progress;
+    see _csv_progress_event_stream for the worker-class requirement.
+    """
+    return _csv_progress_event_stream(session.get('csv_upload_job_id'), _csv_progress_payload)
+
+
 @require_auth
 def cancel_csv_upload():
     """API endpoint to cancel ongoing CSV upload"""
@@ -2556,56 +2554,83 @@ def cancel_csv_upload():
             session.pop('csv_upload_job_id', None)
             session.modified = True
 
-            logger.info(f"CSV upload cancelled for account_id: {g.account_id}, job_id: {job_id}")
+            logger.info("CSV upload cancelled for account_id: %s, job_id: %s", g.account_id, job_id)
             return success_response(message='Upload cancelled successfully')
         else:
             return error_response('Failed to cancel upload', 500)
 
     except (DataIntegrityError, ValidationError) as e:
-        logger.error(f"Error cancelling CSV upload: {str(e)}")
+        logger.error("Error cancelling CSV upload: %s", str(e))
         return error_response(str(e), 400 if isinstance(e, ValidationError) else 500)
     except Exception as e:
-        logger.exception(f"Unexpected error cancelling CSV upload")
+        logger.exception("Unexpected error cancelling CSV upload")
         return error_response('Failed to cancel upload', 500)
 
 
-@require_auth
-def get_portfolio_metrics():
-    """Get portfolio metrics including total value"""
-    try:
-        account_id = g.account_id
+@cache.memoize(timeout=30)
+def _get_portfolio_metrics_internal(account_id: int) -> Dict[str, Any]:
+    """
+    Compute the dashboard metrics for an account.
 
-        # Get portfolio data using the same method as enrich page
-        portfolio_data = get_portfolio_data(account_id)
+    Cached for 30 seconds because dashboards poll this; writes clear it
+    through invalidate_portfolio_cache().
+    """
+    # Counts, value sums and latest update aggregated in SQL, grouped by currency
+    # An item is considered to have a price if it has either market price or custom value
+    currency_totals = PortfolioRepository.get_portfolio_metrics_summary(account_id)
+    total_value = calculate_total_from_currency_totals(currency_totals)
+
+    total_items = sum(row['total_items'] for row in currency_totals)
+    missing_prices = total_items - sum(row['priced_items'] or 0 for row in currency_totals)
+    health = int(((total_items - missing_prices) / total_items * 100) if total_items > 0 else 100)
+
+    last_update = max(
+        (row['last_update'] for row in currency_totals if row['last_update'] is not None),
+        default=None
+    )
 
-        # Calculate total value using centralized utility (handles custom values correctly)
-        total_value = float(calculate_portfolio_total(portfolio_data))
+    return {
+        'total_value': total_value,
+        'total_items': total_items,
+        'health': health,
+        'missing_prices': missing_prices,
+        'last_update': last_update
+    }
 
-        # Count items with missing prices (accounting for custom values)
-        # An item is considered to have a price if it has either market price or custom value
-        missing_prices = sum(
-            1 for item in portfolio_data
-            if not has_price_or_custom_value(item)
-        )
 
-        total_items = len(portfolio_data)
-        health = int(((total_items - missing_prices) / total_items * 100) if total_items > 0 else 100)
+def _portfolio_metrics_etag(account_id: int, metrics: Dict[str, Any]) -> str:
+    """
+    Weak ETag value for an account's metrics payload.
 
-        last_updates = [item['last_updated'] for item in portfolio_data if item['last_updated'] is not None]
+    crc32 rather than hash() so every gunicorn worker computes the same tag.
+    """
+    key = '|'.join([str(account_id)] + [str(metrics.get(field)) for field in (
+        'total_value', 'total_items', 'health', 'missing_prices', 'last_update'
+    )])
+    return f"{zlib.crc32(key.encode()):08x}"
 
-        return jsonify({
-            'total_value': total_value,
-            'total_items': total_items,
-            'health': health,
-            'missing_prices': missing_prices,
-            'last_update': max(last_updates) if last_updates else None
-        })
+
+@require_auth
+def get_portfolio_metrics():
+    """Get portfolio metrics including total value"""
+    try:
+        metrics = _get_portfolio_metrics_internal(g.account_id)
+
+        # Dashboards poll this; unchanged metrics get a 304 without a body
+        etag = _portfolio_metrics_etag(g.account_id, metrics)
+        if request.if_none_match.contains_weak(etag):
+            return Response(status=304, headers={'ETag': f'W/"{etag}"', 'Cache-Control': 'no-cache'})
+
+        response = jsonify(metrics)
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
 
     except (DataIntegrityError, ValidationError) as e:
-        logger.error(f"Error getting portfolio metrics: {str(e)}")
+        logger.error("Error getting portfolio metrics: %s", str(e))
         return error_response(str(e), 400 if isinstance(e, ValidationError) else 500)
     except Exception as e:
-        logger.exception(f"Unexpected error getting portfolio metrics")
+        logger.exception("Unexpected error getting portfolio metrics")
         return error_response('Failed to get portfolio metrics', 500)
 
 
@@ -2666,10 +2691,10 @@ def get_investment_type_distribution():
         })
 
     except (DataIntegrityError, ValidationError) as e:
-        logger.error(f"Error getting investment type distribution: {str(e)}")
+        logger.error("Error getting investment type distribution: %s", str(e))
         return error_response(str(e), 400 if isinstance(e, ValidationError) else 500)
     except Exception as e:
-        logger.exception(f"Unexpected error getting investment type distribution")
+        logger.exception("Unexpected error getting investment type distribution")
         return error_response('Failed to get investment type distribution', 500)
 
 
@@ -2703,7 +2728,7 @@ def simulator_ticker_lookup():
             return validation_error_response('ticker', 'Ticker symbol is required')
 
         account_id = g.account_id
-        logger.info(f"Simulator ticker lookup for: {ticker}")
+        logger.info("Simulator ticker lookup for: %s", ticker)
 
         # Check if ticker exists in user's portfolio
         existing_position = query_db('''
@@ -2732,12 +2757,12 @@ def simulator_ticker_lookup():
         info = get_yfinance_info(ticker)
 
         if not info or 'error' in info:
-            logger.warning(f"Ticker not found or error: {ticker}")
+            logger.warning("Ticker not found or error: %s", ticker)
             return not_found_response(f"Ticker '{ticker}' not found or no data available")
 
         # Check if we got meaningful data (not just an empty dict)
         if not info.get('shortName') and not info.get('longName'):
-            logger.warning(f"No name data for ticker: {ticker}")
+            logger.warning("No name data for ticker: %s", ticker)
             return not_found_response(f"Ticker '{ticker}' not found or no data available")
 
         # Extract relevant fields
@@ -2773,7 +2798,7 @@ def simulator_ticker_lookup():
             if existing_position['thesis']:
                 thesis = existing_position['thesis']
 
-        logger.info(f"Ticker lookup success: {ticker} -> {sector}, {thesis}, {country}, exists={exists_in_portfolio}")
+        logger.info("Ticker lookup success: %s -> %s, %s, %s, exists=%s", ticker, sector, thesis, country, exists_in_portfolio)
 
         return success_response({
             'ticker': ticker,
@@ -2786,7 +2811,7 @@ def simulator_ticker_lookup():
         })
 
     except Exception as e:
-        logger.exception(f"Error in simulator ticker lookup")
+        logger.exception("Error in simulator ticker lookup")
         return error_response('Failed to fetch ticker data', 500)
 
 
@@ -2813,7 +2838,7 @@ def simulator_portfolio_allocations():
         scope = request.args.get('scope', 'global')
         portfolio_id = request.args.get('portfolio_id', type=int)
 
-        logger.info(f"Simulator portfolio allocations: scope={scope}, portfolio_id={portfolio_id}")
+        logger.info("Simulator portfolio allocations: scope=%s, portfolio_id=%s", scope, portfolio_id)
 
         # Build query based on scope
         portfolio_filter = ''
@@ -2937,7 +2962,7 @@ def simulator_portfolio_allocations():
                 'value': round(float(p['value'] or 0), 2)
             })
 
-        logger.info(f"Returning allocations: {len(countries)} countries, {len(sectors)} sectors, {len(theses)} theses, total={total_value:.2f}")
+        logger.info("Returning allocations: %s countries, %s sectors, %s theses, total=%.2f", len(countries), len(sectors), len(theses), total_value)
 
         # Include investment targets if Builder is configured
         investment_targets = None
@@ -2978,7 +3003,7 @@ def simulator_portfolio_allocations():
                             'isOverTarget': total_value > target_amount
                         }
         except Exception as e:
-            logger.warning(f"Could not load investment targets: {e}")
+            logger.warning("Could not load investment targets: %s", e)
 
         return success_response({
             'scope': scope,
@@ -3020,7 +3045,7 @@ def simulator_simulations_list():
 
         simulations = SimulationRepository.get_all(account_id, sim_type=sim_type)
 
-        logger.info(f"Returning {len(simulations)} simulations (type={sim_type}) for account {account_id}")
+        logger.info("Returning %s simulations (type=%s) for account %s", len(simulations), sim_type, account_id)
         return success_response({'simulations': simulations})
 
     except Exception as e:
@@ -3098,7 +3123,7 @@ def simulator_simulation_create():
         # Fetch the created simulation
         simulation = SimulationRepository.get_by_id(simulation_id, account_id)
 
-        logger.info(f"Created simulation '{name}' (id={simulation_id}, type={sim_type})")
+        logger.info("Created simulation '%s' (id=%s, type=%s)", name, simulation_id, sim_type)
         return success_response({'simulation': simulation}, status=201)
 
     except Exception as e:
@@ -3128,7 +3153,7 @@ def simulator_simulation_get(simulation_id: int):
         return success_response({'simulation': simulation})
 
     except Exception as e:
-        logger.exception(f"Error getting simulation {simulation_id}")
+        logger.exception("Error getting simulation %s", simulation_id)
         return error_response('Failed to get simulation', 500)
 
 
@@ -3200,11 +3225,11 @@ def simulator_simulation_update(simulation_id: int):
         # Fetch updated simulation
         simulation = SimulationRepository.get_by_id(simulation_id, account_id)
 
-        logger.info(f"Updated simulation {simulation_id}")
+        logger.info("Updated simulation %s", simulation_id)
         return success_response({'simulation': simulation})
 
     except Exception as e:
-        logger.exception(f"Error updating simulation {simulation_id}")
+        logger.exception("Error updating simulation %s", simulation_id)
         return error_response('Failed to update simulation', 500)
 
 
@@ -3233,11 +3258,11 @@ def simulator_simulation_delete(simulation_id: int):
         if not success:
             return error_response('Failed to delete simulation', 500)
 
-        logger.info(f"Deleted simulation {simulation_id}")
+        logger.info("Deleted simulation %s", simulation_id)
         return success_response({'message': 'Simulation deleted successfully'})
 
     except Exception as e:
-        logger.exception(f"Error deleting simulation {simulation_id}")
+        logger.exception("Error deleting simulation %s", simulation_id)
         return error_response('Failed to delete simulation', 500)
 
 
@@ -3417,7 +3442,7 @@ def simulator_clone_portfolio():
 
         simulation = SimulationRepository.get_by_id(simulation_id, account_id)
 
-        logger.info(f"Cloned portfolio '{portfolio_name}' (id={portfolio_id}) into simulation '{name}' (id={simulation_id}, {len(items)} positions)")
+        logger.info("Cloned portfolio '%s' (id=%s) into simulation '%s' (id=%s, %s positions)", portfolio_name, portfolio_id, name, simulation_id, len(items))
         return success_response({'simulation': simulation}, status=201)
 
     except Exception as e:
@@ -3470,7 +3495,7 @@ def builder_investment_targets():
                 'partialData': targets  # Include partial data for UI flexibility
             }), 400
 
-        logger.info(f"Returning investment targets for account {account_id}: {len(targets['portfolioTargets'])} portfolios")
+        logger.info("Returning investment targets for account %s: %s portfolios", account_id, len(targets['portfolioTargets']))
         return success_response(targets)
 
     except Exception as e:
@@ -3498,7 +3523,7 @@ def get_account_cash():
         account_id = g.account_id
         cash = AccountRepository.get_cash(account_id)
 
-        logger.debug(f"Returning cash balance for account {account_id}: {cash}")
+        logger.debug("Returning cash balance for account %s: %s", account_id, cash)
         return jsonify({
             'success': True,
             'cash': cash
@@ -3546,7 +3571,7 @@ def set_account_cash():
         if not success:
             return error_response('Failed to update cash balance', 500)
 
-        logger.info(f"Updated cash balance for account {account_id}: {cash}")
+        logger.info("Updated cash balance for account %s: %s", account_id, cash)
         return jsonify({
             'success': True,
             'cash': cash
@@ -3597,6 +3622,8 @@ def add_company():
         result = CompanyService.add_company_manual(account_id, data)
 
         if result.get('success'):
+            # The new company's price row is shared by every account holding it
+            invalidate_portfolio_cache()
             return jsonify(result), 201
         elif result.get('error') == 'duplicate':
             return jsonify(result), 409  # Conflict
@@ -3668,6 +3695,8 @@ def delete_manual_companies():
             return validation_error_response('company_ids', 'company_ids must be a non-empty list')
 
         result = CompanyService.delete_manual_companies(account_id, company_ids)
+        if result.get('deleted_count'):
+            invalidate_portfolio_cache(account_id)
 
         return jsonify(result)
 
@@ -3715,10 +3744,6 @@ def get_historical_prices_api():
 
     Returns JSON with series keyed by original identifiers.
     """
-    from app.utils.yfinance_utils import get_historical_prices, VALID_PERIODS
-    from app.utils.identifier_mapping import get_preferred_identifier
-    import re
-
     account_id = g.account_id
 
     raw_identifiers = request.args.get('identifiers', '')
@@ -3738,7 +3763,7 @@ def get_historical_prices_api():
 
     # Validate start_date format if provided (mutually exclusive with period)
     if start_date:
-        if not re.match(r'^\d{4}-\d{2}-\d{2}$', start_date):
+        if not _START_DATE_PATTERN.match(start_date):
             return validation_error_response('start_date', 'start_date must be in YYYY-MM-DD format')
     elif period not in VALID_PERIODS:
         return validation_error_response('period', f'Invalid period. Must be one of: {", ".join(sorted(VALID_PERIODS))}')
@@ -10,8 +10,9 @@ from app.cache import cache
 from app.routes.portfolio_api import (
     get_portfolios_api, get_portfolio_data_api, get_single_portfolio_data_api, manage_state,
     get_simulator_portfolio_data, get_country_capacity_data, get_sector_capacity_data,
+    get_country_capacity_positions, get_sector_capacity_positions,
     get_effective_capacity_data, update_portfolio_api, upload_csv, manage_portfolios,
-    csv_upload_progress, cancel_csv_upload, get_portfolio_metrics, get_investment_type_distribution,
+    csv_upload_progress, csv_upload_progress_stream, cancel_csv_upload, get_portfolio_metrics, get_investment_type_distribution,
     simulator_ticker_lookup, simulator_portfolio_allocations,
     simulator_simulations_list, simulator_simulation_create, simulator_simulation_get,
     simulator_simulation_update, simulator_simulation_delete,
@@ -23,7 +24,7 @@ from app.routes.portfolio_api import (
 )
 from app.routes.portfolio_updates import update_price_api, update_single_portfolio_api, bulk_update, get_portfolio_companies, update_all_prices, update_selected_prices, price_fetch_progress, price_update_status
 from app.utils.data_processing import clear_data_caches
-from app.utils.portfolio_utils import get_portfolio_data, has_companies_in_default
+from app.utils.portfolio_utils import get_portfolio_data
 
 # Set up logger
 logger = logging.getLogger(__name__)
@@ -299,13 +300,19 @@ portfolio_bp.add_url_rule('/api/simulator/country-capacity',
                           view_func=get_country_capacity_data)
 portfolio_bp.add_url_rule('/api/simulator/sector-capacity',
                           view_func=get_sector_capacity_data)
+portfolio_bp.add_url_rule('/api/simulator/country-capacity/positions',
+                          view_func=get_country_capacity_positions)
+portfolio_bp.add_url_rule('/api/simulator/sector-capacity/positions',
+                          view_func=get_sector_capacity_positions)
 portfolio_bp.add_url_rule('/api/simulator/effective-capacity',
                           view_func=get_effective_capacity_data)
 portfolio_bp.add_url_rule('/api/portfolios', view_func=get_portfolios_api)
 # Simple upload - no background complexity
-from app.routes.simple_upload import upload_csv_simple, get_simple_upload_progress
+from app.routes.simple_upload import upload_csv_simple, get_simple_upload_progress, simple_upload_progress_stream
 portfolio_bp.add_url_rule('/upload', 'upload_csv', upload_csv_simple, methods=['POST'])
 portfolio_bp.add_url_rule('/api/simple_upload_progress', 'simple_upload_progress', get_simple_upload_progress, methods=['GET', 'DELETE'])
+portfolio_bp.add_url_rule('/api/simple_upload_progress/stream', 'simple_upload_progress_stream',
+                          simple_upload_progress_stream, methods=['GET'])
 portfolio_bp.add_url_rule('/api/update_portfolio',
                           view_func=update_portfolio_api, methods=['POST'])
 portfolio_bp.add_url_rule('/manage_portfolios',
@@ -324,6 +331,8 @@ portfolio_bp.add_url_rule('/api/price_fetch_progress',
                           view_func=price_fetch_progress, methods=['GET'])
 portfolio_bp.add_url_rule('/api/csv_upload_progress',
                           view_func=csv_upload_progress, methods=['GET', 'DELETE'])
+portfolio_bp.add_url_rule('/api/csv_upload_progress/stream',
+                          view_func=csv_upload_progress_stream, methods=['GET'])
 portfolio_bp.add_url_rule('/api/cancel_csv_upload',
                           view_func=cancel_csv_upload, methods=['POST'])
 portfolio_bp.add_url_rule('/api/price_update_status/<string:job_id>',
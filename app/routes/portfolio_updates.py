@@ -2,6 +2,7 @@ from flask import request, session, jsonify, g
 from app.db_manager import query_db, backup_database, get_db
 from app.utils.portfolio_utils import get_stock_info
 from app.utils.db_utils import update_price_in_db
+from app.utils.yfinance_utils import clear_price_cache
 from app.utils.batch_processing import start_batch_process, get_job_status, get_latest_job_progress
 from app.decorators import require_auth
 from app.utils.response_helpers import success_response, error_response, not_found_response, validation_error_response, service_unavailable_response
@@ -34,7 +35,7 @@ def update_price_api(company_id: int):
             logger.warning(f"Company {company_id} not found or access denied for account {account_id}")
             return not_found_response('Company', company_id)
 
-        identifier = company['identifier'] if isinstance(company, dict) else None
+        identifier = company['identifier']
         if not identifier:
             logger.warning(f"Company {company_id} has no identifier set")
             return error_response('Company has no identifier set', 400)
@@ -43,6 +44,8 @@ def update_price_api(company_id: int):
 
         # backup_database()  # Consider if this is needed for single updates
 
+        # An explicit refresh must not be answered from the 15 minute price cache
+        clear_price_cache(identifier)
         result = get_stock_info(identifier)
         if not result.get('success'):
             error_msg = result.get('error', 'Unknown error')
@@ -68,6 +71,9 @@ def update_price_api(company_id: int):
             modified_identifier=modified_identifier
         ):
             logger.info(f"Successfully updated price in database for {identifier}")
+            # The price is shared by every account holding this identifier
+            from .portfolio_api import invalidate_portfolio_cache
+            invalidate_portfolio_cache()
             return success_response(
                 data={
                     'identifier': identifier,
@@ -293,9 +299,21 @@ def update_single_portfolio_api(company_id):
         # Apply the update
         with get_db() as db:
             cursor = db.cursor()
-            from .portfolio_api import _apply_company_update
-            _apply_company_update(cursor, company_id, data, account_id)
+            from .portfolio_api import _apply_company_update, invalidate_portfolio_cache
+            price_identifier = _apply_company_update(cursor, company_id, data, account_id)
             db.commit()
+        invalidate_portfolio_cache(account_id)
+
+        # Fetch the new identifier's price in the background; the client can
+        # poll price_update_status with the returned job id
+        # The update is already committed, so a failure here must not fail the request
+        response_data = {}
+        if price_identifier:
+            try:
+                response_data['price_job_id'] = start_batch_process([price_identifier])
+            except Exception as e:
+                logger.error(f"Failed to start price update for {price_identifier}: {e}")
+                response_data['price_job_id'] = None
 
         # If this is a country reset, fetch and return the updated company data
         if data.get('reset_country', False):
@@ -306,15 +324,10 @@ def update_single_portfolio_api(company_id):
             updated_company = next((item for item in portfolio_data if item['id'] == company_id), None)
             
             if updated_company:
-                return success_response(
-                    data={
-                        'effective_country': updated_company['effective_country'],
-                        'country_manually_edited': updated_company['country_manually_edited']
-                    },
-                    message='Company updated successfully'
-                )
-
-        return success_response(message='Company updated successfully')
+                response_data['effective_country'] = updated_company['effective_country']
+                response_data['country_manually_edited'] = updated_company['country_manually_edited']
+
+        return success_response(data=response_data or None, message='Company updated successfully')
     except (DataIntegrityError, ValidationError, NotFoundError) as e:
         logger.error(f"Error updating company {company_id}: {str(e)}")
         status_code = 400 if isinstance(e, ValidationError) else 404 if isinstance(e, NotFoundError) else 500
@@ -334,32 +347,62 @@ def bulk_update():
             return error_response('Invalid data format', 400)
         updated = 0
         errors = []
+        price_identifiers = []
         with get_db() as db:
             cursor = db.cursor()
-            from .portfolio_api import _apply_company_update
+            from .portfolio_api import (
+                _apply_company_update, invalidate_portfolio_cache, _IN_CLAUSE_CHUNK_SIZE
+            )
+            # Load every requested company once: checks ownership and gives
+            # _apply_company_update the current identifier without a per-item SELECT
+            requested_ids = list({item.get('id') for item in data if item.get('id')})
+            owned_companies = {}
+            for start in range(0, len(requested_ids), _IN_CLAUSE_CHUNK_SIZE):
+                chunk = requested_ids[start:start + _IN_CLAUSE_CHUNK_SIZE]
+                placeholders = ','.join('?' * len(chunk))
+                owned_companies.update((row['id'], row) for row in cursor.execute(
+                    f'SELECT id, identifier, name FROM companies WHERE account_id = ? AND id IN ({placeholders})',
+                    [account_id, *chunk]
+                ))
+            applied_ids = set()
             for item in data:
                 cid = item.get('id')
                 if not cid:
                     errors.append({'id': None, 'error': 'Missing id'})
                     continue
-                company = query_db('SELECT id FROM companies WHERE id = ? AND account_id = ?', [
-                                   cid, account_id], one=True)
-                if not company:
+                if cid not in owned_companies:
                     errors.append({'id': cid, 'error': 'Company not found'})
                     continue
+                # A repeated id re-reads the row an earlier item may have changed
+                current_company = owned_companies[cid] if cid not in applied_ids else None
+                applied_ids.add(cid)
                 try:
-                    _apply_company_update(cursor, cid, item, account_id)
+                    price_identifier = _apply_company_update(
+                        cursor, cid, item, account_id, current_company=current_company
+                    )
+                    if price_identifier:
+                        price_identifiers.append(price_identifier)
                     updated += 1
                 except Exception as exc:
                     errors.append({'id': cid, 'error': str(exc)})
             db.commit()
+        if updated:
+            invalidate_portfolio_cache(account_id)
+        response_data = {'updated': updated}
+        if price_identifiers:
+            # Updates are committed; a price job that fails to start is only logged
+            try:
+                response_data['price_job_id'] = start_batch_process(list(dict.fromkeys(price_identifiers)))
+            except Exception as e:
+                logger.error(f"Failed to start price update for changed identifiers: {e}")
+                response_data['price_job_id'] = None
         if errors:
             return error_response(
                 f'{updated} items updated, {len(errors)} failed',
                 400,
-                details={'updated': updated, 'errors': errors}
+                details={**response_data, 'errors': errors}
             )
-        return success_response(data={'updated': updated}, message=f'Successfully updated {updated} companies')
+        return success_response(data=response_data, message=f'Successfully updated {updated} companies')
     except (DataIntegrityError, ValidationError) as e:
         logger.error(f"Error in bulk update: {str(e)}")
         return error_response(str(e), 400 if isinstance(e, ValidationError) else 500)
@@ -5,14 +5,60 @@ Uses background threads with database-based progress tracking for real-time upda
 
 import logging
 import threading
+from typing import Any, Dict, Optional
 from flask import request, session, jsonify, flash, redirect, url_for, current_app, g
 from app.utils.csv_import_simple import validate_csv_format
-from app.utils.batch_processing import start_csv_processing_job
+from app.utils.batch_processing import (
+    start_csv_processing_job, get_csv_job_progress, save_csv_upload, discard_csv_upload
+)
 from app.decorators import require_auth
+from app.routes.portfolio_api import _csv_progress_event_stream
 from app.utils.response_helpers import success_response, error_response, not_found_response, validation_error_response
 
 logger = logging.getLogger(__name__)
 
+def _simple_progress_payload(job_id: Optional[str], job_status: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert a background job status into the simple upload progress format"""
+    status = job_status.get('status')
+
+    if job_id and status == 'processing':
+        return {
+            'current': job_status.get('progress', 0),
+            'total': job_status.get('total', 100),
+            'percentage': int((job_status.get('progress', 0) / max(job_status.get('total', 1), 1)) * 100),
+            'message': job_status.get('message', 'Processing...'),
+            'status': 'processing',
+            'job_id': job_id
+        }
+    if job_id and status == 'completed':
+        return {
+            'current': job_status.get('total', 100),
+            'total': job_status.get('total', 100),
+            'percentage': 100,
+            'message': job_status.get('message', 'Upload completed successfully!'),
+            'status': 'completed',
+            'job_id': job_id
+        }
+    if job_id and status == 'failed':
+        return {
+            'current': 0,
+            'total': 0,
+            'percentage': 0,
+            'message': job_status.get('message', 'Upload failed'),
+            'status': 'failed',
+            'job_id': job_id
+        }
+
+    # No job_id or job not found - idle status
+    return {
+        'current': 0,
+        'total': 0,
+        'percentage': 0,
+        'message': 'No active upload',
+        'status': 'idle'
+    }
+
+
 @require_auth
 def get_simple_upload_progress():
     """
@@ -22,66 +68,27 @@ def get_simple_upload_progress():
         if request.method == 'GET':
             # Check for job_id in session
             job_id = session.get('csv_upload_job_id')
+            # Get progress from memory when this worker runs the job, else the database
+            job_status = get_csv_job_progress(job_id) if job_id else {'status': 'not_found'}
             
             if job_id:
-                # Get progress from database using existing function
-                from app.utils.batch_processing import get_job_status
-                job_status = get_job_status(job_id)
-                
-                logger.debug(f"Session has job_id={job_id}, job_status={job_status.get('status')}")
+                logger.debug("Session has job_id=%s, job_status=%s", job_id, job_status.get('status'))
                 
                 # Clear completed/failed jobs from session
                 if job_status.get('status') in ['completed', 'failed', 'cancelled']:
-                    logger.info(f"Job {job_id} has terminal status '{job_status.get('status')}', clearing from session")
+                    logger.debug("Job %s has terminal status '%s', clearing from session", job_id, job_status.get('status'))
                     if 'csv_upload_job_id' in session:
                         del session['csv_upload_job_id']
                         session.modified = True
                 
-                # Return progress data
-                if job_status.get('status') == 'processing':
-                    return jsonify({
-                        'current': job_status.get('progress', 0),
-                        'total': job_status.get('total', 100),
-                        'percentage': int((job_status.get('progress', 0) / max(job_status.get('total', 1), 1)) * 100),
-                        'message': job_status.get('message', 'Processing...'),
-                        'status': 'processing',
-                        'job_id': job_id
-                    })
-                elif job_status.get('status') == 'completed':
-                    return jsonify({
-                        'current': job_status.get('total', 100),
-                        'total': job_status.get('total', 100),
-                        'percentage': 100,
-                        'message': job_status.get('message', 'Upload completed successfully!'),
-                        'status': 'completed',
-                        'job_id': job_id
-                    })
-                elif job_status.get('status') == 'failed':
-                    return jsonify({
-                        'current': 0,
-                        'total': 0,
-                        'percentage': 0,
-                        'message': job_status.get('message', 'Upload failed'),
-                        'status': 'failed',
-                        'job_id': job_id
-                    })
             
-            # No job_id or job not found - return idle status
-            return jsonify({
-                'current': 0,
-                'total': 0,
-                'percentage': 0,
-                'message': 'No active upload',
-                'status': 'idle'
-            })
+            return jsonify(_simple_progress_payload(job_id, job_status))
         
         elif request.method == 'DELETE':
             # Clear CSV upload job from session
-            job_id = session.get('csv_upload_job_id')
+            job_id = session.pop('csv_upload_job_id', None)
             if job_id:
                 logger.info(f"Manually clearing CSV upload job {job_id} for account {session.get('account_id')}")
-                del session['csv_upload_job_id']
-                session.modified = True
             
             return jsonify({'message': f'CSV upload progress cleared (was tracking job_id: {job_id})'})
         
@@ -89,6 +96,17 @@ def get_simple_upload_progress():
         logger.error(f"Error handling simple upload progress: {e}")
         return error_response('Error handling progress', 500)
 
+@require_auth
+def simple_upload_progress_stream():
+    """
+    Stream background upload progress as Server-Sent Events.
+
+    Opt-in: the upload endpoint's Location header and the bundled frontend use
+    the polling endpoint, since each open stream holds a worker (see
+    _csv_progress_event_stream).
+    """
+    return _csv_progress_event_stream(session.get('csv_upload_job_id'), _simple_progress_payload)
+
 @require_auth
 def upload_csv_simple():
     """
@@ -123,14 +141,15 @@ def upload_csv_simple():
         return redirect(url_for('portfolio.enrich'))
 
     try:
-        # Read file content
-        file_content = file.read().decode('utf-8-sig')  # Handle BOM
-        logger.info(f"CSV file content length: {len(file_content)} characters")
+        # Copy the upload to a temp file; the header check only needs the preview
+        csv_path, csv_preview = save_csv_upload(file.stream)
+        logger.info(f"CSV file saved for background processing: {csv_path}")
         
         # Quick validation
-        valid, validation_message = validate_csv_format(file_content)
+        valid, validation_message = validate_csv_format(csv_preview)
         if not valid:
             logger.warning(f"CSV validation failed: {validation_message}")
+            discard_csv_upload(csv_path)
             if is_ajax:
                 return validation_error_response('csv_file', validation_message)
             flash(validation_message, 'error')
@@ -145,7 +164,7 @@ def upload_csv_simple():
 
         try:
             # Start background job and get job_id
-            job_id = start_csv_processing_job(account_id, file_content, mode=mode)
+            job_id = start_csv_processing_job(account_id, csv_path, mode=mode)
             
             # Store job_id in session for progress tracking
             session['csv_upload_job_id'] = job_id
@@ -153,12 +172,16 @@ def upload_csv_simple():
             
             logger.info(f"CSV processing job started successfully with job_id: {job_id}")
             
-            # Return immediate response with job_id
+            # Accept the job and point the client at its progress endpoint
             if is_ajax:
-                return success_response(
-                    data={'job_id': job_id, 'redirect': url_for('portfolio.enrich')},
-                    message='Upload started successfully'
+                progress_url = url_for('portfolio.simple_upload_progress')
+                response, status = success_response(
+                    data={'job_id': job_id, 'progress_url': progress_url, 'redirect': url_for('portfolio.enrich')},
+                    message='Upload started successfully',
+                    status=202
                 )
+                response.headers['Location'] = progress_url
+                return response, status
             flash('Upload started successfully. Please wait for completion.', 'info')
             return redirect(url_for('portfolio.enrich'))
 
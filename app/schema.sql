@@ -52,7 +52,7 @@ CREATE TABLE IF NOT EXISTS company_shares (
  csv_modified_after_edit BOOLEAN DEFAULT 0,
  FOREIGN KEY (company_id) REFERENCES companies (id)
 );
--- Create market_prices table
+-- Create market_prices table (clustered on identifier, the only lookup key)
 CREATE TABLE IF NOT EXISTS market_prices (
  identifier TEXT PRIMARY KEY,
  price REAL,
@@ -60,7 +60,7 @@ CREATE TABLE IF NOT EXISTS market_prices (
  price_eur REAL,
  last_updated DATETIME,
  country TEXT
-);
+) WITHOUT ROWID;
 -- Create expanded_state table
 CREATE TABLE IF NOT EXISTS expanded_state (
  id INTEGER PRIMARY KEY,
@@ -124,9 +124,8 @@ CREATE TABLE IF NOT EXISTS simulations (
 
 -- Create indexes for market_prices (only if they don't exist)
 CREATE INDEX IF NOT EXISTS idx_market_prices_last_updated ON market_prices(last_updated);
-CREATE INDEX IF NOT EXISTS idx_market_prices_identifier ON market_prices(identifier);
 -- Create indexes for expanded_state
-CREATE INDEX IF NOT EXISTS idx_state_lookup ON expanded_state(account_id, page_name, variable_name);
+-- Lookups by (account_id, page_name, variable_name) use the UNIQUE constraint index
 CREATE INDEX IF NOT EXISTS idx_state_type ON expanded_state(variable_type);
 CREATE INDEX IF NOT EXISTS idx_state_updated ON expanded_state(last_updated);
 -- Create indexes for identifier_mappings
@@ -134,8 +133,10 @@ CREATE INDEX IF NOT EXISTS idx_identifier_mappings_account ON identifier_mapping
 CREATE INDEX IF NOT EXISTS idx_identifier_mappings_csv_id ON identifier_mappings(csv_identifier);
 CREATE INDEX IF NOT EXISTS idx_identifier_mappings_preferred ON identifier_mappings(preferred_identifier);
 -- Indexes for portfolio data query performance
-CREATE INDEX IF NOT EXISTS idx_companies_account_id ON companies(account_id);
-CREATE INDEX IF NOT EXISTS idx_company_shares_company_id ON company_shares(company_id);
+-- Lookups by (account_id, name) on portfolios and companies use the UNIQUE constraint
+-- indexes; market_prices.identifier and company_shares.company_id are primary keys
+-- Covers the companies columns read by the metrics summary, so it is answered from the index
+CREATE INDEX IF NOT EXISTS idx_companies_account_covering ON companies(account_id, identifier, is_custom_value, custom_total_value);
 CREATE INDEX IF NOT EXISTS idx_companies_portfolio_id ON companies(portfolio_id);
 CREATE INDEX IF NOT EXISTS idx_companies_identifier ON companies(identifier);
 CREATE INDEX IF NOT EXISTS idx_companies_name ON companies(name);
@@ -459,7 +459,7 @@ class AllocationService:
         # Build mapping of company names to investment types from portfolio_data
         company_investment_types = {}
         for row in portfolio_data:
-            if isinstance(row, dict) and row.get('company_name'):
+            if row.get('company_name'):
                 company_investment_types[row['company_name']] = row.get('investment_type')
 
         # Helper function to get default weight based on investment type
@@ -538,54 +538,53 @@ class AllocationService:
         # Process actual positions from database
         if portfolio_data:
             for row in portfolio_data:
-                if isinstance(row, dict):
-                    pid = row['portfolio_id']
-                    pname = row['portfolio_name']
-
-                    # Ensure portfolio exists in map (may already be initialized above)
-                    portfolio = portfolio_map.setdefault(
-                        pid, {'name': pname, 'sectors': {}, 'currentValue': 0})
-
-                    if row['company_name']:
-                        # Use 'Uncategorized' as default sector
-                        sector_name = row['sector'] if row['sector'] else 'Uncategorized'
-                        cat = portfolio['sectors'].setdefault(
-                            sector_name, {'positions': [], 'currentValue': 0})
-
-                        # Use centralized value calculator for consistency
-                        pos_value = float(calculate_item_value(row))
-
-                        portfolio['currentValue'] += pos_value
-                        cat['currentValue'] += pos_value
-
-                        # Look up by portfolio NAME (not ID) for reliable matching
-                        lookup_key = (pname, row['company_name'])
-                        target_weight = position_target_weights.get(lookup_key, 0)
-
-                        # Check if this portfolio uses placeholder-based equal distribution
-                        builder_config = portfolio_builder_data.get(pname, {})
-                        use_placeholder_weight = builder_config.get('use_placeholder_weight', False)
-                        placeholder_weight_value = builder_config.get('placeholder_weight', None)
-
-                        # If no target weight from Build page, determine default
-                        if target_weight == 0:
-                            # Priority: placeholder weight > type-based default
-                            if use_placeholder_weight and placeholder_weight_value:
-                                target_weight = float(placeholder_weight_value)
-                            elif row.get('investment_type') in ['Stock', 'ETF']:
-                                if row.get('investment_type') == 'Stock':
-                                    target_weight = default_stock_weight
-                                elif row.get('investment_type') == 'ETF':
-                                    target_weight = default_etf_weight
-
-                        position_data = {
-                            'name': row['company_name'],
-                            'currentValue': pos_value,
-                            'targetAllocation': target_weight,
-                            'identifier': row['identifier'],
-                            'investment_type': row.get('investment_type')
-                        }
-                        cat['positions'].append(position_data)
+                pid = row['portfolio_id']
+                pname = row['portfolio_name']
+
+                # Ensure portfolio exists in map (may already be initialized above)
+                portfolio = portfolio_map.setdefault(
+                    pid, {'name': pname, 'sectors': {}, 'currentValue': 0})
+
+                if row['company_name']:
+                    # Use 'Uncategorized' as default sector
+                    sector_name = row['sector'] if row['sector'] else 'Uncategorized'
+                    cat = portfolio['sectors'].setdefault(
+                        sector_name, {'positions': [], 'currentValue': 0})
+
+                    # Use centralized value calculator for consistency
+                    pos_value = float(calculate_item_value(row))
+
+                    portfolio['currentValue'] += pos_value
+                    cat['currentValue'] += pos_value
+
+                    # Look up by portfolio NAME (not ID) for reliable matching
+                    lookup_key = (pname, row['company_name'])
+                    target_weight = position_target_weights.get(lookup_key, 0)
+
+                    # Check if this portfolio uses placeholder-based equal distribution
+                    builder_config = portfolio_builder_data.get(pname, {})
+                    use_placeholder_weight = builder_config.get('use_placeholder_weight', False)
+                    placeholder_weight_value = builder_config.get('placeholder_weight', None)
+
+                    # If no target weight from Build page, determine default
+                    if target_weight == 0:
+                        # Priority: placeholder weight > type-based default
+                        if use_placeholder_weight and placeholder_weight_value:
+                            target_weight = float(placeholder_weight_value)
+                        elif row.get('investment_type') in ['Stock', 'ETF']:
+                            if row.get('investment_type') == 'Stock':
+                                target_weight = default_stock_weight
+                            elif row.get('investment_type') == 'ETF':
+                                target_weight = default_etf_weight
+
+                    position_data = {
+                        'name': row['company_name'],
+                        'currentValue': pos_value,
+                        'targetAllocation': target_weight,
+                        'identifier': row['identifier'],
+                        'investment_type': row.get('investment_type')
+                    }
+                    cat['positions'].append(position_data)
 
         logger.info(f"Processed {len(portfolio_map)} portfolios with positions")
         return portfolio_map, portfolio_builder_data
@@ -1,10 +1,13 @@
+import codecs
 import logging
+import os
+import tempfile
 import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import uuid
 import json
 from datetime import datetime
-from typing import Dict, Any, List
+from typing import Dict, Any, List, BinaryIO, Tuple
 import time
 
 from flask import current_app
@@ -21,6 +24,55 @@ logger = logging.getLogger(__name__)
 # For single-user homeserver, small batches are faster with synchronous processing
 ASYNC_THRESHOLD = 20
 
+# Latest CSV job progress, kept in memory by the worker process running the job.
+# Progress writes to background_jobs are throttled, so pollers served by this
+# process see every update; requests on other workers fall back to the database.
+CSV_PROGRESS_RETENTION_SECONDS = 300
+_csv_progress: Dict[str, Dict[str, Any]] = {}
+_csv_progress_lock = threading.Lock()
+
+# Uploaded CSVs are copied to a temp file in chunks of this size; the first
+# decoded chunk doubles as the preview used for request-time validation
+CSV_UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+def record_csv_progress(job_id: str, progress: int, message: str, status: str = 'processing'):
+    """Store the latest progress of a CSV job for pollers in this process."""
+    now = time.monotonic()
+    with _csv_progress_lock:
+        previous = _csv_progress.get(job_id)
+        if previous and previous['status'] == 'cancelled' and status == 'processing':
+            # The job thread reports progress once more before it notices the cancel
+            return
+        _csv_progress[job_id] = {
+            'job_id': job_id,
+            'status': status,
+            'progress': progress,
+            'total': 100,
+            'message': message,
+            # Running jobs never expire; finished ones are kept for late pollers
+            'expires_at': float('inf') if status == 'processing' else now + CSV_PROGRESS_RETENTION_SECONDS
+        }
+        # Drop finished jobs nobody is polling anymore
+        stale_ids = [jid for jid, entry in _csv_progress.items() if now > entry['expires_at']]
+        for jid in stale_ids:
+            del _csv_progress[jid]
+
+
+def get_csv_job_progress(job_id: str) -> Dict[str, Any]:
+    """
+    Get CSV job progress for polling endpoints.
+
+    Served from memory when this process runs the job, otherwise from the
+    background_jobs table. Cancellation checks inside the job itself must keep
+    using get_job_status() so they see cancellations made by other workers.
+    """
+    with _csv_progress_lock:
+        entry = _csv_progress.get(job_id)
+        if entry is not None:
+            return dict(entry)
+    return get_job_status(job_id)
+
 
 def _extract_price_data(result: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -130,11 +182,12 @@ def _process_single_identifier(identifier: str) -> Dict[str, Any]:
         }
 
 
-def _run_csv_job(app, account_id: int, file_content: str, job_id: str, mode: str = 'replace'):
+def _run_csv_job(app, account_id: int, file_path: str, job_id: str, mode: str = 'replace'):
     """
     Background job to process a CSV file.
     This runs in a separate thread with Flask application context.
     Uses database-based progress tracking to avoid session context issues.
+    Reads the CSV from the temp file written by save_csv_upload() and removes it.
     """
     with app.app_context():
         try:
@@ -144,6 +197,10 @@ def _run_csv_job(app, account_id: int, file_content: str, job_id: str, mode: str
             # Import here to avoid circular imports
             from app.utils.portfolio_processing import process_csv_data_background
 
+            # newline='' keeps line endings exactly as uploaded
+            with open(file_path, encoding='utf-8-sig', newline='') as csv_file:
+                file_content = csv_file.read()
+
             logger.debug(f" About to call process_csv_data_background with job_id: {job_id}")
             # Use the background version that doesn't depend on session
             success, message, result = process_csv_data_background(account_id, file_content, job_id, mode=mode)
@@ -171,6 +228,8 @@ def _run_csv_job(app, account_id: int, file_content: str, job_id: str, mode: str
                 _update_csv_job_final(job_id, 0, f"Processing failed: {str(e)}", "failed")
             except Exception as db_error:
                 logger.error(f"Failed to update error status in database: {db_error}")
+        finally:
+            discard_csv_upload(file_path)
 
 
 def _update_csv_job_progress(job_id: str, progress: int, message: str = "Processing..."):
@@ -186,6 +245,7 @@ def _update_csv_job_progress(job_id: str, progress: int, message: str = "Process
 
 def _update_csv_job_final(job_id: str, progress: int, message: str, status: str = "completed"):
     """Mark CSV job as completed or failed in the database."""
+    record_csv_progress(job_id, progress, message, status)
     try:
         execute_background_db(
             "UPDATE background_jobs SET status = ?, progress = ?, result = ?, updated_at = ? WHERE id = ?",
@@ -195,9 +255,62 @@ def _update_csv_job_final(job_id: str, progress: int, message: str, status: str
         logger.error(f"Failed to finalize CSV job {job_id}: {e}")
 
 
-def start_csv_processing_job(account_id: int, file_content: str, mode: str = 'replace') -> str:
+def save_csv_upload(stream: BinaryIO) -> Tuple[str, str]:
+    """
+    Copy an uploaded CSV to a temp file for start_csv_processing_job().
+
+    The upload is decoded chunk by chunk while it is copied, so a file that
+    is not UTF-8 is still rejected at request time without holding the
+    whole upload in memory as both bytes and str.
+
+    Returns:
+        Tuple of (temp file path, preview). The preview is the first decoded
+        chunk, or '' when the file is empty or only whitespace.
+
+    Raises:
+        UnicodeDecodeError: If the upload is not valid UTF-8 (the temp file
+            is removed first)
+    """
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    preview = ''
+    has_content = False
+
+    fd, file_path = tempfile.mkstemp(prefix='csv-upload-', suffix='.csv')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            while True:
+                chunk = stream.read(CSV_UPLOAD_CHUNK_SIZE)
+                final = not chunk
+                text = decoder.decode(chunk, final=final)
+                if not preview:
+                    preview = text
+                if not has_content and text and not text.isspace():
+                    has_content = True
+                if final:
+                    break
+                tmp.write(chunk)
+    except BaseException:
+        discard_csv_upload(file_path)
+        raise
+
+    return file_path, preview if has_content else ''
+
+
+def discard_csv_upload(file_path: str) -> None:
+    """Remove a temp file written by save_csv_upload(), if it still exists."""
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Failed to remove CSV upload {file_path}: {e}")
+
+
+def start_csv_processing_job(account_id: int, file_path: str, mode: str = 'replace') -> str:
     """
     Starts a background thread to process the uploaded CSV file.
+    Takes ownership of file_path (from save_csv_upload), which is removed
+    once the job finishes or if it cannot be started.
     Returns job_id for tracking progress.
     """
     app = current_app._get_current_object()  # type: ignore
@@ -220,7 +333,7 @@ def start_csv_processing_job(account_id: int, file_content: str, mode: str = 're
         logger.debug(f" Creating background thread for job_id: {job_id}")
         thread = threading.Thread(
             target=_run_csv_job,
-            args=(app, account_id, file_content, job_id, mode),
+            args=(app, account_id, file_path, job_id, mode),
             name=f"csv-processing-{account_id}-{job_id[:8]}"
         )
         thread.daemon = True
@@ -231,6 +344,7 @@ def start_csv_processing_job(account_id: int, file_content: str, mode: str = 're
         
     except Exception as e:
         logger.error(f"Failed to start CSV processing job: {e}")
+        discard_csv_upload(file_path)
         raise
 
 
@@ -255,6 +369,13 @@ def _run_batch_job(app, job_id: str, identifiers: List[str]):
             logger.info(f"Processing {total_items} identifiers SYNC (< {ASYNC_THRESHOLD})")
             _run_batch_sync(job_id, identifiers, total_items)
 
+        # Prices are shared across accounts, so every account's cache is stale
+        try:
+            from app.routes.portfolio_api import invalidate_portfolio_cache
+            invalidate_portfolio_cache()
+        except Exception as cache_error:
+            logger.warning(f"Failed to invalidate cache after price update: {cache_error}")
+
 
 def _track_batch_result(
     result: Dict[str, Any],
@@ -516,6 +637,12 @@ def cancel_background_job(job_id: str) -> bool:
         )
         
         if rowcount > 0:
+            with _csv_progress_lock:
+                if job_id in _csv_progress:
+                    _csv_progress[job_id].update(
+                        status='cancelled', message='Upload cancelled by user',
+                        expires_at=time.monotonic() + CSV_PROGRESS_RETENTION_SECONDS
+                    )
             logger.info(f"Background job {job_id} marked as cancelled")
             return True
         else:
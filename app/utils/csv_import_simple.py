@@ -527,7 +527,7 @@ def import_csv_simple(account_id: int, file_content: str) -> Tuple[bool, str]:
         
         # CRITICAL: Always backup before processing [[memory:7528819]]
         logger.info("Creating automatic backup before CSV processing...")
-        backup_database()
+        backup_database(force=True)
         
         # Parse CSV with common delimiters
         try:
@@ -852,16 +852,33 @@ def remove_position_completely(account_id: int, identifier: str) -> bool:
         logger.error(f"Failed to remove position {identifier}: {e}")
         return False
 
+def _first_lines(text: str, count: int) -> list:
+    """
+    Same result as text.split('\\n')[:count], without splitting the whole upload
+    into a list of lines just to look at the header.
+    """
+    lines = []
+    start = 0
+    while len(lines) < count:
+        end = text.find('\n', start)
+        if end == -1:
+            lines.append(text[start:])
+            break
+        lines.append(text[start:end])
+        start = end + 1
+    return lines
+
+
 def validate_csv_format(file_content: str) -> Tuple[bool, str]:
     """
     Quick validation of CSV format before processing.
     """
     try:
-        if not file_content.strip():
+        if not file_content or file_content.isspace():
             return False, "CSV file is empty"
         
         # Try parsing first few lines
-        lines = file_content.split('\n')[:5]
+        lines = _first_lines(file_content, 5)
         if len(lines) < 2:
             return False, "CSV must have at least header and one data row"
         
@@ -7,6 +7,8 @@ import pandas as pd
 import logging
 from typing import Dict, Tuple
 from app.db_manager import query_db
+from app.utils.identifier_normalization import normalize_identifier
+from app.utils.identifier_mapping import get_preferred_identifier
 
 logger = logging.getLogger(__name__)
 
@@ -30,9 +32,6 @@ def process_companies(df: pd.DataFrame, account_id: int, cursor) -> Tuple[Dict[s
         - Dict[str, int]: company_name -> company_id mapping
         - Dict[str, Dict]: company_name -> position data (shares, invested, identifier)
     """
-    from app.utils.identifier_normalization import normalize_identifier
-    from app.utils.identifier_mapping import get_preferred_identifier
-
     logger.info("FIRST PASS: Processing buy and transferin transactions")
 
     company_positions = {}
@@ -189,9 +188,6 @@ def process_companies_snapshot(df: pd.DataFrame, account_id: int, cursor) -> Tup
         - Dict[str, Dict]: company_name -> existing DB record (id, name, identifier, etc.)
         - Dict[str, Dict]: company_name -> position data (shares, invested, identifier, etc.)
     """
-    from app.utils.identifier_normalization import normalize_identifier
-    from app.utils.identifier_mapping import get_preferred_identifier
-
     logger.info("Processing snapshot positions (IBKR mode)")
 
     company_positions = {}
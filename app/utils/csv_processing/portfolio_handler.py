@@ -23,23 +23,13 @@ def assign_portfolios(account_id: int, cursor) -> int:
     Returns:
         int: Default portfolio ID
     """
-    default_portfolio = query_db(
-        'SELECT id FROM portfolios WHERE account_id = ? AND name = "-"',
-        [account_id],
-        one=True,
-    )
-
-    if not default_portfolio:
-        logger.info(f"Creating default portfolio '-' for account {account_id}")
-        cursor.execute(
-            'INSERT INTO portfolios (name, account_id) VALUES (?, ?)',
-            ['-', account_id],
-        )
-        default_portfolio_id = cursor.lastrowid
-        logger.info(f"Created default portfolio with ID: {default_portfolio_id}")
-    else:
-        default_portfolio_id = default_portfolio['id']
-        logger.info(f"Using existing default portfolio ID: {default_portfolio_id}")
+    # One UPSERT on UNIQUE(account_id, name) returns the existing or new id
+    default_portfolio_id = cursor.execute('''
+        INSERT INTO portfolios (name, account_id) VALUES ('-', ?)
+        ON CONFLICT(account_id, name) DO UPDATE SET name = excluded.name
+        RETURNING id
+    ''', [account_id]).fetchone()[0]
+    logger.info(f"Using default portfolio ID: {default_portfolio_id}")
 
     return default_portfolio_id
 
@@ -11,6 +11,9 @@ from app.utils.yfinance_utils import get_isin_data
 
 logger = logging.getLogger(__name__)
 
+# Names per IN (...) lookup; stays below SQLite's historical 999-variable limit
+_IN_CLAUSE_CHUNK_SIZE = 900
+
 
 def update_prices_from_csv(
     account_id: int,
@@ -29,21 +32,9 @@ def update_prices_from_csv(
         List[str]: Identifiers that failed to update
     """
     # Get all identifiers for companies to update
-    all_identifiers = set()
+    all_identifiers = get_identifiers_for_update(account_id, positions_to_update)
     failed_prices = []
 
-    for company_name in positions_to_update:
-        company = query_db(
-            'SELECT id, identifier FROM companies WHERE name = ? AND account_id = ?',
-            [company_name, account_id],
-            one=True
-        )
-        if company and company['identifier']:
-            all_identifiers.add(company['identifier'])
-            logger.debug(f"Found identifier for {company_name}: {company['identifier']}")
-        else:
-            logger.debug(f"No identifier found for company: {company_name}")
-
     if not all_identifiers:
         logger.info("No identifiers found for price updates")
         return failed_prices
@@ -140,15 +131,17 @@ def get_identifiers_for_update(account_id: int, company_names: List[str]) -> Set
         Set[str]: Set of identifiers to update
     """
     identifiers = set()
-
-    for company_name in company_names:
-        company = query_db(
-            'SELECT identifier FROM companies WHERE name = ? AND account_id = ?',
-            [company_name, account_id],
-            one=True
+    names = list(dict.fromkeys(company_names))
+
+    # One IN (...) query per chunk instead of one SELECT per company
+    for start in range(0, len(names), _IN_CLAUSE_CHUNK_SIZE):
+        chunk = names[start:start + _IN_CLAUSE_CHUNK_SIZE]
+        placeholders = ','.join('?' * len(chunk))
+        rows = query_db(
+            f'SELECT identifier FROM companies WHERE account_id = ? AND name IN ({placeholders})',
+            [account_id, *chunk]
         )
-        if company and company['identifier']:
-            identifiers.add(company['identifier'])
+        identifiers.update(row['identifier'] for row in rows or [] if row['identifier'])
 
     logger.info(f"Found {len(identifiers)} identifiers for price updates")
     return identifiers
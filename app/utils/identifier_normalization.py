@@ -58,7 +58,8 @@ def normalize_identifier(identifier: str) -> str:
         return identifier
 
     clean_identifier = identifier.strip().upper()
-    logger.info(f"Cleaned identifier: '{identifier}' -> '{clean_identifier}'")
+    # Called once per CSV row; callers log the identifiers they act on
+    logger.debug("Cleaned identifier: '%s' -> '%s'", identifier, clean_identifier)
 
     return clean_identifier
 
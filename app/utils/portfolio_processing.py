@@ -3,6 +3,7 @@ import logging
 import io
 import threading
 import time
+from datetime import datetime
 from flask import session
 from app.db_manager import query_db, execute_db, backup_database, get_db
 from app.utils.db_utils import update_price_in_db
@@ -10,6 +11,7 @@ from app.utils.yfinance_utils import get_isin_data
 from app.utils.data_processing import clear_data_caches
 from app.utils.identifier_normalization import normalize_identifier
 from app.utils.identifier_mapping import get_preferred_identifier
+from app.utils.batch_processing import record_csv_progress
 
 logger = logging.getLogger(__name__)
 
@@ -20,9 +22,8 @@ def get_thread_db():
     """Get or create database connection for current thread."""
     if not hasattr(_thread_local_db, 'connection'):
         from app.db_manager import get_background_db
+        # get_background_db() already applies WAL, busy_timeout and synchronous=NORMAL
         _thread_local_db.connection = get_background_db()
-        _thread_local_db.connection.execute('PRAGMA journal_mode=WAL')
-        _thread_local_db.connection.execute('PRAGMA busy_timeout=5000')
     return _thread_local_db.connection
 
 def close_thread_db():
@@ -52,7 +53,7 @@ class ThreadDBContext:
         return False  # Don't suppress exceptions
 
 # Progress update throttling
-_last_progress_update = {}  # job_id -> timestamp
+_last_progress_update = {}  # job_id -> time.monotonic() of last DB write
 _progress_update_lock = threading.Lock()
 
 
@@ -97,10 +98,9 @@ def process_csv_data(account_id, file_content):
 
         # CRITICAL: Always create backup before processing [[memory:7528819]]
         logger.info("Creating automatic backup before CSV processing...")
-        backup_database()
+        backup_database(force=True)
 
         # Add small delay to ensure progress is captured
-        import time
         time.sleep(0.1)
 
         df = pd.read_csv(io.StringIO(file_content),
@@ -762,7 +762,7 @@ def process_csv_data_refactored(account_id: int, file_content: str, progress_cal
 
         # CRITICAL: Always create backup before processing
         logger.info("Creating automatic backup before CSV processing...")
-        backup_database()
+        backup_database(force=True)
 
         # Step 1: Detect format and parse CSV file
         logger.info("Step 1: Detecting format and parsing CSV file...")
@@ -948,16 +948,19 @@ def _seed_ibkr_prices(company_positions, cursor):
 
 def update_csv_progress_background(job_id: str, current: int, total: int, message: str = "Processing...", status: str = "processing"):
     """Update CSV upload progress with throttling - max 1 per second per job."""
+    # In-memory progress is cheap, so pollers in this process see every update
+    percentage = int((current / total) * 100) if total > 0 else 0
+    record_csv_progress(job_id, percentage, message, status)
 
     # Always update immediately for terminal states
     if status in ['completed', 'failed', 'cancelled']:
         _do_progress_update(job_id, current, total, message, status)
         return
 
-    # Throttle in-progress updates to 1 per second
-    current_time = time.time()
+    # Throttle in-progress updates to 1 per second (monotonic: immune to clock changes)
+    current_time = time.monotonic()
     with _progress_update_lock:
-        last_update = _last_progress_update.get(job_id, 0)
+        last_update = _last_progress_update.get(job_id, float('-inf'))
 
         # Skip if updated within last 1 second
         if current_time - last_update < 1.0:
@@ -973,8 +976,6 @@ def _do_progress_update(job_id: str, current: int, total: int, message: str, sta
     percentage = int((current / total) * 100) if total > 0 else 0
 
     try:
-        from datetime import datetime
-
         # Use thread-local connection (reused)
         db = get_thread_db()
 
@@ -1052,7 +1053,7 @@ def process_csv_data_background(account_id: int, file_content: str, job_id: str,
             try:
                 # CRITICAL: Always create backup before processing [[memory:7528819]]
                 logger.info("Creating automatic backup before CSV processing...")
-                backup_database()
+                backup_database(force=True)
 
                 # Call the simple CSV import which now uses our background progress tracking
                 success, message = import_csv_simple(account_id, file_content)
@@ -43,23 +43,17 @@ def get_portfolio_data(account_id):
 
 def has_companies_in_default(account_id):
     """Check if the '-' portfolio has any companies with shares"""
-    default_portfolio = query_db('''
-        SELECT id FROM portfolios
-        WHERE account_id = ? AND name = '-'
-    ''', [account_id], one=True)
-
-    if default_portfolio:
-        # Check if this portfolio has any companies with shares
-        companies_count = query_db('''
-            SELECT COUNT(*) as count
-            FROM companies c
+    result = query_db('''
+        SELECT EXISTS (
+            SELECT 1
+            FROM portfolios p
+            JOIN companies c ON c.portfolio_id = p.id AND c.account_id = p.account_id
             JOIN company_shares cs ON c.id = cs.company_id
-            WHERE c.portfolio_id = ? AND c.account_id = ?
-        ''', [default_portfolio['id'], account_id], one=True)
-
-        return companies_count and companies_count['count'] > 0
+            WHERE p.account_id = ? AND p.name = '-'
+        ) AS has_companies
+    ''', [account_id], one=True)
 
-    return False
+    return bool(result and result['has_companies'])
 
 
 def get_stock_info(identifier):
@@ -223,7 +223,7 @@ def schedule_automatic_backups():
 
                 # Perform backup (with app context for database access)
                 with app.app_context():
-                    backup_file = backup_database()
+                    backup_file = backup_database(force=True)
                     if backup_file:
                         logger.info(f"Automatic database backup completed: {backup_file}")
                     else:
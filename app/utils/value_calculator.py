@@ -195,6 +195,38 @@ def calculate_portfolio_total(items: List[Dict[str, Any]]) -> Decimal:
     return sum(calculate_item_value(item) for item in items)
 
 
+def calculate_total_from_currency_totals(currency_totals: List[Dict[str, Any]]) -> float:
+    """
+    Combine per-currency value sums from SQL into one EUR total.
+
+    The database sums each valuation bucket grouped by currency (see
+    PortfolioRepository.get_portfolio_metrics_summary); only the native
+    bucket still needs converting, which takes one exchange rate lookup
+    per currency instead of one per item.
+
+    Args:
+        currency_totals: Rows with keys currency, custom_total,
+                         native_total and eur_total
+
+    Returns:
+        float: Total value in EUR
+
+    Examples:
+        >>> calculate_total_from_currency_totals([
+        ...     {'currency': 'EUR', 'custom_total': 5000, 'native_total': 1000, 'eur_total': 0},
+        ...     {'currency': None, 'custom_total': 0, 'native_total': 0, 'eur_total': 250}
+        ... ])
+        6250.0
+    """
+    total = 0.0
+    for row in currency_totals:
+        total += float(row.get('custom_total') or 0) + float(row.get('eur_total') or 0)
+        native_total = row.get('native_total') or 0
+        if native_total:
+            total += float(native_total) * _get_exchange_rate(row.get('currency'))
+    return total
+
+
 def get_value_calculation_sql() -> str:
     """
     Get SQL expression for calculating item value in database queries.
@@ -48,6 +48,7 @@ class Config:
     DB_BACKUP_DIR = os.environ.get('DB_BACKUP_DIR', os.path.join(APP_DATA_DIR, 'backups'))
     MAX_BACKUP_FILES = int(os.environ.get('MAX_BACKUP_FILES', '10'))
     BACKUP_INTERVAL_HOURS = int(os.environ.get('BACKUP_INTERVAL_HOURS', '6'))  # Automatic backup every N hours
+    BACKUP_MIN_INTERVAL_SECONDS = int(os.environ.get('BACKUP_MIN_INTERVAL_SECONDS', '300'))  # Debounce for backups before writes
 
     # Market data settings (configurable via environment variables)
     PRICE_UPDATE_INTERVAL = timedelta(hours=int(os.environ.get('PRICE_UPDATE_INTERVAL_HOURS', '24')))
@@ -61,6 +62,10 @@ class Config:
     # Default number of items to show in pagination (configurable via environment variables)
     PER_PAGE = int(os.environ.get('PER_PAGE', '20'))
 
+    # Server-Sent Events progress streams hold a worker for up to a minute each;
+    # only enable them with a non-sync gunicorn worker class (gthread/gevent)
+    PROGRESS_STREAMING_ENABLED = os.environ.get('PROGRESS_STREAMING_ENABLED', 'false').lower() == 'true'
+
 
 class DevelopmentConfig(Config):
     """Development configuration."""
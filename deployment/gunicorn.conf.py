@@ -7,6 +7,9 @@ backlog = 2048
 
 # Worker processes
 workers = 4
+# Sync workers serve one request at a time, so the SSE progress streams stay
+# disabled (PROGRESS_STREAMING_ENABLED); switch to "gthread" or "gevent" first
+# if you enable them
 worker_class = "sync"
 worker_connections = 1000
 timeout = 120
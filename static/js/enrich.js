@@ -2321,6 +2321,22 @@ class PortfolioTableApp {
 
 
 
+                // Poll a background price update job until it finishes (or ~30s pass)
+                async waitForPriceJob(jobId) {
+                    for (let attempt = 0; attempt < 30; attempt++) {
+                        try {
+                            const response = await fetch(`/portfolio/api/price_update_status/${jobId}`);
+                            if (!response.ok) return;
+                            const status = await response.json();
+                            if (status.is_complete) return;
+                        } catch (error) {
+                            console.error('Error polling price update job:', error);
+                            return;
+                        }
+                        await new Promise(resolve => setTimeout(resolve, 1000));
+                    }
+                },
+
                 // Save identifier changes to the database
                 async saveIdentifierChange(item) {
                     if (!item || !item.id) {
@@ -2346,6 +2362,12 @@ class PortfolioTableApp {
                         const result = await response.json();
 
                         if (result.success) {
+                            // The price is fetched by a background job; wait for it before refreshing
+                            const priceJobId = result.data && result.data.price_job_id;
+                            if (priceJobId) {
+                                await this.waitForPriceJob(priceJobId);
+                            }
+
                             // Show success notification using the global function if available
                             if (typeof showNotification === 'function') {
                                 showNotification('Identifier updated and price fetched automatically', 'is-success', 3000);
@@ -2353,7 +2375,7 @@ class PortfolioTableApp {
                                 debugLog('Identifier updated and price fetched automatically');
                             }
 
-                            // Refresh the data to show updated price (backend handles price update automatically)
+                            // Refresh the data to show updated price
                             await this.loadData();
                         } else {
                             // Show error notification
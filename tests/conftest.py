@@ -0,0 +1,57 @@
+"""Shared pytest fixtures: one app on a throwaway database, one account per test."""
+
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+# config.py reads these at import time, so they are set before the app is imported
+_DATA_DIR = tempfile.mkdtemp(prefix='portfolio-tests-')
+os.environ.setdefault('SECRET_KEY', 'test-secret-key')
+os.environ['APP_DATA_DIR'] = _DATA_DIR
+os.environ['FLASK_ENV'] = 'testing'
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.main import create_app  # noqa: E402
+from app.db_manager import get_db  # noqa: E402
+
+
+@pytest.fixture(scope='session', autouse=True)
+def _isolated_cwd():
+    """backup_database writes to the working-directory-relative instance/backups"""
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(_DATA_DIR)
+        yield
+
+
+@pytest.fixture(scope='session')
+def app():
+    app = create_app('development')
+    app.config.update(TESTING=True, SESSION_COOKIE_SECURE=False)
+    return app
+
+
+@pytest.fixture
+def account_id(app):
+    """A fresh account, so tests never see each other's companies"""
+    with app.app_context():
+        db = get_db()
+        account_id = db.execute(
+            "INSERT INTO accounts (username, created_at) VALUES (?, CURRENT_TIMESTAMP) RETURNING id",
+            [f'test-{uuid.uuid4().hex}']
+        ).fetchone()[0]
+        db.commit()
+    return account_id
+
+
+@pytest.fixture
+def client(app, account_id):
+    """Test client logged in as account_id"""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['account_id'] = account_id
+        session['username'] = 'test'
+    return client
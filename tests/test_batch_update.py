@@ -0,0 +1,114 @@
+"""Tests for the batch update endpoint (POST /portfolio/api/update_portfolio)."""
+
+from app.db_manager import get_db
+
+
+def _add_company(app, account_id, name, identifier, shares=None):
+    with app.app_context():
+        db = get_db()
+        company_id = db.execute(
+            "INSERT INTO companies (name, identifier, sector, account_id) VALUES (?, ?, 'Tech', ?) RETURNING id",
+            [name, identifier, account_id]
+        ).fetchone()[0]
+        if shares is not None:
+            db.execute("INSERT INTO company_shares (company_id, shares) VALUES (?, ?)", [company_id, shares])
+        db.commit()
+    return company_id
+
+
+def _fetch_one(app, query, args):
+    with app.app_context():
+        return tuple(get_db().execute(query, args).fetchone())
+
+
+def test_last_write_wins_for_repeated_company(app, account_id, client):
+    x_id = _add_company(app, account_id, 'X', 'XID')
+
+    # Three different statement shapes for the same company, in request order
+    response = client.post('/portfolio/api/update_portfolio', json=[
+        {'company': 'X', 'identifier': 'XID', 'sector': 'S1', 'portfolio': 'A'},
+        {'company': 'X', 'identifier': 'XID', 'sector': 'S3', 'portfolio': 'A', 'investment_type': 'ETF'},
+        {'company': 'X', 'identifier': 'XID', 'sector': 'S4', 'portfolio': 'B'},
+    ])
+    assert response.status_code == 200
+
+    assert _fetch_one(app, '''
+        SELECT c.sector, p.name, c.investment_type
+        FROM companies c JOIN portfolios p ON p.id = c.portfolio_id
+        WHERE c.id = ?
+    ''', [x_id]) == ('S4', 'B', 'ETF')
+
+
+def test_plain_then_user_edit_shares_keeps_override(app, account_id, client):
+    y_id = _add_company(app, account_id, 'Y', 'YID', shares=1)
+
+    response = client.post('/portfolio/api/update_portfolio', json=[
+        {'company': 'Y', 'identifier': 'YID', 'shares': 4},
+        {'company': 'Y', 'identifier': 'YID', 'override_share': 9, 'is_user_edit': True},
+    ])
+    assert response.status_code == 200
+
+    assert _fetch_one(app, '''
+        SELECT shares, override_share, is_manually_edited FROM company_shares WHERE company_id = ?
+    ''', [y_id]) == (4.0, 9.0, 1)
+
+
+def test_user_edit_then_plain_shares_keeps_request_order(app, account_id, client):
+    y_id = _add_company(app, account_id, 'Y', 'YID', shares=1)
+
+    response = client.post('/portfolio/api/update_portfolio', json=[
+        {'company': 'Y', 'identifier': 'YID', 'override_share': 9, 'is_user_edit': True},
+        {'company': 'Y', 'identifier': 'YID', 'shares': 4},
+    ])
+    assert response.status_code == 200
+
+    # The later plain write replaces the override, as it did when items ran one by one
+    assert _fetch_one(app, '''
+        SELECT shares, override_share FROM company_shares WHERE company_id = ?
+    ''', [y_id]) == (4.0, None)
+
+
+def test_mixed_batch_applies_items_in_order(app, account_id, client):
+    x_id = _add_company(app, account_id, 'X', 'XID')
+    y_id = _add_company(app, account_id, 'Y', 'YID', shares=1)
+
+    response = client.post('/portfolio/api/update_portfolio', json=[
+        {'company': 'X', 'identifier': 'XID', 'sector': 'S1', 'portfolio': 'A'},
+        {'company': 'X', 'identifier': 'XID', 'sector': 'S3', 'portfolio': 'A', 'investment_type': 'ETF'},
+        {'company': 'X', 'identifier': 'XID', 'sector': 'S4', 'portfolio': 'B'},
+        {'company': 'Y', 'identifier': 'YID', 'shares': 4},
+        {'company': 'Y', 'identifier': 'YID', 'override_share': 9, 'is_user_edit': True},
+    ])
+    assert response.status_code == 200
+
+    assert _fetch_one(app, '''
+        SELECT c.sector, p.name, c.investment_type
+        FROM companies c JOIN portfolios p ON p.id = c.portfolio_id
+        WHERE c.id = ?
+    ''', [x_id]) == ('S4', 'B', 'ETF')
+    assert _fetch_one(app, '''
+        SELECT shares, override_share FROM company_shares WHERE company_id = ?
+    ''', [y_id]) == (4.0, 9.0)
+
+
+def test_identifier_change_survives_price_refresh_failure(app, account_id, client, monkeypatch):
+    from app.routes import portfolio_api
+
+    z_id = _add_company(app, account_id, 'Z', 'OLDID')
+    invalidated = []
+
+    def fail_to_start(identifiers):
+        raise RuntimeError('price service unavailable')
+
+    monkeypatch.setattr(portfolio_api, 'start_batch_process', fail_to_start)
+    monkeypatch.setattr(portfolio_api, 'invalidate_portfolio_cache', invalidated.append)
+
+    response = client.post('/portfolio/api/update_portfolio', json=[
+        {'company': 'Z', 'identifier': 'NEWID', 'sector': 'Tech'},
+    ])
+    assert response.status_code == 200
+    assert 'price_job_id' not in (response.get_json().get('data') or {})
+
+    # The committed batch stands and the cache is still invalidated
+    assert _fetch_one(app, 'SELECT identifier FROM companies WHERE id = ?', [z_id]) == ('NEWID',)
+    assert invalidated == [account_id]
@@ -0,0 +1,36 @@
+"""Tests that cached portfolio metrics follow writes to the portfolio."""
+
+
+def _metrics(client):
+    response = client.get('/portfolio/api/portfolio_metrics')
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_metrics_follow_manual_company_add_and_delete(client):
+    assert _metrics(client)['total_items'] == 0
+
+    response = client.post('/portfolio/api/add_company', json={
+        'name': 'Private Holding', 'sector': 'Other', 'shares': 2, 'total_value': 500,
+    })
+    assert response.status_code == 201
+    company_id = response.get_json()['company_id']
+
+    metrics = _metrics(client)
+    assert (metrics['total_items'], metrics['total_value']) == (1, 500.0)
+
+    response = client.post('/portfolio/api/delete_companies', json={'company_ids': [company_id]})
+    assert response.get_json()['deleted_count'] == 1
+    assert _metrics(client)['total_items'] == 0
+
+
+def test_metrics_follow_account_delete_stocks(client):
+    response = client.post('/portfolio/api/add_company', json={
+        'name': 'Private Holding', 'sector': 'Other', 'shares': 2, 'total_value': 500,
+    })
+    assert response.status_code == 201
+    assert _metrics(client)['total_items'] == 1
+
+    response = client.post('/account/delete-stocks-crypto')
+    assert response.status_code == 302
+    assert _metrics(client)['total_items'] == 0
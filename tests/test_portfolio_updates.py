@@ -0,0 +1,28 @@
+"""Tests for the single and bulk company update endpoints."""
+
+from app.routes import portfolio_updates
+from tests.test_batch_update import _add_company, _fetch_one
+
+
+def _fail_to_start(identifiers):
+    raise RuntimeError('price service unavailable')
+
+
+def test_single_update_survives_price_job_failure(app, account_id, client, monkeypatch):
+    company_id = _add_company(app, account_id, 'S', 'OLDID')
+    monkeypatch.setattr(portfolio_updates, 'start_batch_process', _fail_to_start)
+
+    response = client.post(f'/portfolio/api/update_portfolio/{company_id}', json={'identifier': 'NEWID'})
+    assert response.status_code == 200
+    assert response.get_json()['data']['price_job_id'] is None
+    assert _fetch_one(app, 'SELECT identifier FROM companies WHERE id = ?', [company_id]) == ('NEWID',)
+
+
+def test_bulk_update_survives_price_job_failure(app, account_id, client, monkeypatch):
+    company_id = _add_company(app, account_id, 'B', 'OLDID')
+    monkeypatch.setattr(portfolio_updates, 'start_batch_process', _fail_to_start)
+
+    response = client.post('/portfolio/api/bulk_update', json=[{'id': company_id, 'identifier': 'NEWID'}])
+    assert response.status_code == 200
+    assert response.get_json()['data'] == {'updated': 1, 'price_job_id': None}
+    assert _fetch_one(app, 'SELECT identifier FROM companies WHERE id = ?', [company_id]) == ('NEWID',)
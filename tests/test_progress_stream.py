@@ -0,0 +1,25 @@
+"""Tests for the opt-in Server-Sent Events upload progress streams."""
+
+import pytest
+
+STREAM_URLS = [
+    '/portfolio/api/csv_upload_progress/stream',
+    '/portfolio/api/simple_upload_progress/stream',
+]
+
+
+@pytest.mark.parametrize('url', STREAM_URLS)
+def test_stream_is_disabled_by_default(client, url):
+    response = client.get(url)
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize('url', STREAM_URLS)
+def test_stream_serves_events_when_enabled(app, client, monkeypatch, url):
+    monkeypatch.setitem(app.config, 'PROGRESS_STREAMING_ENABLED', True)
+
+    # Without an upload job in the session the stream sends one event and ends
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    assert 'data: ' in response.get_data(as_text=True)